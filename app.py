@@ -1,18 +1,52 @@
 import os
 import requests  # Indispensable pour n8n
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, make_response, flash
+from flask import Flask, render_template, request, redirect, url_for, session, make_response, flash, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from dotenv import load_dotenv
 from openai import OpenAI
 from fpdf import FPDF
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
 import io
 import base64
 import tempfile
+import hashlib
+import hmac
+import json
+import csv
+import uuid
+import struct
+import threading
+import time
+import sqlite3
+import random
+from functools import wraps
+import click
+import numpy as np
+import sys
+import cProfile
+import tracemalloc
+from collections import OrderedDict, namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+# Verrous de fichiers pour les créneaux partagés entre workers (absent sous Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Export colonnaire (Arrow IPC / Parquet) : dépendance optionnelle (pip install pyarrow)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # 1. Chargement des variables d'environnement
 load_dotenv()
@@ -20,12 +54,59 @@ load_dotenv()
 # 2. Configuration de l'application Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'audit_s2i_dimension6_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///evolucheck.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///evolucheck.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Webhook n8n (surchargeable, p. ex. par un serveur factice pour les tests de charge)
+app.config['N8N_WEBHOOK_URL'] = os.getenv('N8N_WEBHOOK_URL', "https://amineboubou12.app.n8n.cloud/webhook-test/audit-alert")
+app.config['N8N_TIMEOUT'] = float(os.getenv('N8N_TIMEOUT', 10)) # s
+
+# Cache des rapports PDF (mémoire par worker + disque partagé entre workers gunicorn)
+app.config['PDF_CACHE_DIR'] = os.getenv('PDF_CACHE_DIR', os.path.join(app.instance_path, 'cache_pdf'))
+app.config['PDF_CACHE_MAX_MEMOIRE'] = int(os.getenv('PDF_CACHE_MAX_MEMOIRE', 32 * 1024 * 1024)) # octets
+app.config['PDF_CACHE_MAX_DISQUE'] = int(os.getenv('PDF_CACHE_MAX_DISQUE', 256 * 1024 * 1024)) # octets
+
+# Mémoire de conversation d'EvoluBot (estimation : ~4 caractères par token)
+app.config['CHAT_BUDGET_TOKENS'] = int(os.getenv('CHAT_BUDGET_TOKENS', 1000)) # Échanges récents conservés mot pour mot
+app.config['CHAT_BUDGET_BAS'] = int(os.getenv('CHAT_BUDGET_BAS', 500)) # Niveau visé après résumé : un résumé toutes les quelques questions
+app.config['CHAT_BUDGET_RESUME'] = int(os.getenv('CHAT_BUDGET_RESUME', 200)) # Résumé des échanges plus anciens
+
+# Graphiques de portefeuille (rendu parallèle, cache mémoire par audit dans chaque worker)
+app.config['GRAPHIQUES_PROCESSUS'] = int(os.getenv('GRAPHIQUES_PROCESSUS', min(4, os.cpu_count() or 1))) # 1 : rendu dans le worker
+app.config['GRAPHIQUES_CACHE_MAX'] = int(os.getenv('GRAPHIQUES_CACHE_MAX', 512)) # rendus
+app.config['GRAPHIQUES_MAX_AUDITS'] = int(os.getenv('GRAPHIQUES_MAX_AUDITS', 200)) # audits par requête
+
+# Emails (vérifiés par Google) autorisés à lire les audits de tous les utilisateurs (export, graphiques)
+app.config['ACCES_GLOBAL'] = {e.strip().lower() for e in os.getenv('ACCES_GLOBAL_EMAILS', '').split(',') if e.strip()}
+
+# Profilage à la demande (désactivé par défaut : aucun hook n'est alors installé)
+app.config['PROFILAGE_ACTIF'] = os.getenv('PROFILAGE_ACTIF', '0') == '1'
+app.config['PROFILAGE_TAUX'] = float(os.getenv('PROFILAGE_TAUX', 0.0)) # Fraction des requêtes profilées (en-tête X-Profilage: <PROFILAGE_SECRET> pour forcer)
+app.config['PROFILAGE_INTERVALLE'] = float(os.getenv('PROFILAGE_INTERVALLE', 0.005)) # s entre deux échantillons de pile
+app.config['PROFILAGE_DIR'] = os.getenv('PROFILAGE_DIR', os.path.join(app.instance_path, 'profils'))
+app.config['PROFILAGE_SECRET'] = os.getenv('PROFILAGE_SECRET', '') # Valeur exigée dans l'en-tête X-Profilage (vide : en-tête ignoré)
+app.config['PROFILAGE_MAX_PROFILS'] = int(os.getenv('PROFILAGE_MAX_PROFILS', 50)) # Seuls les plus récents sont conservés
+
+# Contrôle d'admission des endpoints coûteux (état partagé entre workers dans ADMISSION_DIR)
+app.config['ADMISSION_ACTIVE'] = os.getenv('ADMISSION_ACTIVE', '1') == '1'
+app.config['ADMISSION_DIR'] = os.getenv('ADMISSION_DIR', os.path.join(app.instance_path, 'admission'))
+app.config['LIMITES_ADMISSION'] = {
+    # endpoint : exécutions simultanées max (tous workers), débit (requêtes/s par client), rafale
+    'export_pdf': {'concurrence': 4, 'debit': 0.5, 'rafale': 5},
+    'import_csv': {'concurrence': 2, 'debit': 0.2, 'rafale': 3},
+    'portefeuille': {'concurrence': 2, 'debit': 0.2, 'rafale': 3},
+    'chat_api': {'concurrence': 8, 'debit': 0.5, 'rafale': 5},
+    'simulation': {'concurrence': 4, 'debit': 1, 'rafale': 5},
+    'export_audits': {'concurrence': 2, 'debit': 0.1, 'rafale': 2},
+    'graphiques': {'concurrence': 4, 'debit': 1, 'rafale': 10},
+}
+
 # FIX POUR PYTHONANYWHERE (HTTPS)
+# Nombre de proxys de confiance devant l'application (1 sur PythonAnywhere, 0 si exposée directement) :
+# au-delà, X-Forwarded-For est fourni par le client et ne doit pas servir à l'identifier (limitation de charge)
+app.config['PROXY_HOPS'] = int(os.getenv('PROXY_HOPS', 1))
 from werkzeug.middleware.proxy_fix import ProxyFix
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'], x_host=app.config['PROXY_HOPS'])
 
 # Initialisation BDD et Services
 db = SQLAlchemy(app)
@@ -58,104 +139,643 @@ class Audit(db.Model):
     dette_technique = db.Column(db.String(20)) # 'faible', 'moyenne', 'critique'
     taux_transformation_poc = db.Column(db.Float) # %
     part_energie_verte = db.Column(db.Float) # %
+    # KPIs bruts (permettent de recalculer les scores si les règles changent)
+    dep_fournisseur = db.Column(db.Float) # %
+    temps_deploy = db.Column(db.Integer) # jours
+    arch_modulaire = db.Column(db.String(3)) # 'oui', 'non'
+    budget_rd = db.Column(db.Float) # %
+    nb_poc = db.Column(db.Integer)
+    pue = db.Column(db.Float)
+    recyclage = db.Column(db.String(3)) # 'oui', 'non'
+    regles_version = db.Column(db.Integer) # Version des règles ayant produit les scores
+    # Empreinte du contenu importé (ré-import idempotent d'un même CSV)
+    empreinte = db.Column(db.String(64), unique=True, index=True)
+    site = db.Column(db.String(100)) # Identifiant de site (colonne optionnelle du CSV)
+
+class ConversationChat(db.Model):
+    id = db.Column(db.String(32), primary_key=True) # Identifiant conservé dans la session
+    date_maj = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    resume = db.Column(db.Text, default='') # Synthèse des échanges sortis du budget
+    tours = db.Column(db.Text, default='[]') # JSON : échanges récents, mot pour mot
+    contexte = db.Column(db.Text) # Contexte d'audit pré-calculé pour le prompt système
+    contexte_cle = db.Column(db.String(64)) # Empreinte de l'audit ayant produit `contexte`
+
+# Correspondance clé d'entrée (inputs) -> colonne brute de la table Audit
+COLONNES_KPI = {
+    'dep': 'dep_fournisseur', 'temps': 'temps_deploy', 'arch': 'arch_modulaire',
+    'rd': 'budget_rd', 'poc': 'nb_poc',
+    'pue': 'pue', 'rec': 'recyclage',
+    'dette': 'dette_technique', 'taux_transfo': 'taux_transformation_poc', 'energie_verte': 'part_energie_verte'
+}
+
+# --- RÈGLES DE SCORING ---
+# Toute modification d'un seuil doit s'accompagner d'un incrément de REGLES_VERSION,
+# puis d'un `flask rescorer` pour mettre à jour les audits déjà stockés.
+
+REGLES_VERSION = 1
+
+SEUIL_FRAP = 60 # Score global <= 60 : FRAP
+SEUIL_FRABOP = 80 # Score global >= 80 : FRABOP
+
+# Adaptabilité
+SEUIL_DEP = 10 # % de dépendance fournisseur
+SEUILS_TEMPS = (7, 15) # jours (2 points, 1 point)
+# Innovation
+SEUILS_RD = (5, 2) # % du budget (3 points, 1 point)
+PLAFOND_POC = 2
+SEUIL_TAUX_TRANSFO = 40 # % (bonus)
+# Durabilité
+SEUILS_PUE = (1.4, 1.6) # (3 points, 1 point)
+SEUIL_ENERGIE_VERTE = 50 # % (bonus)
+# Recommandations
+SEUIL_RECO_PILIER = 3 # Note /5 en dessous de laquelle un pilier est en alerte
+SEUIL_RECO_POC = 2
+SEUIL_RECO_TRANSFO = 20
+SEUIL_RECO_ENERGIE = 30
+
+RECOMMANDATIONS = (
+    # Adaptabilité
+    {"titre": "Urgence Adaptabilité", "texte": "Réduire la dette technique et le temps de déploiement."},
+    {"titre": "Architecture Monolithique", "texte": "Migrer progressivement vers une architecture modulaire (Microservices/API) pour gagner en agilité."},
+    {"titre": "Dette Technique Critique", "texte": "Planifier un sprint de refactoring immédiat. La dette technique freine toute évolution."},
+    # Innovation
+    {"titre": "Déficit Innovation", "texte": "Augmenter le budget R&D (> 5%)."},
+    {"titre": "Culture de l'Expérimentation", "texte": "Lancer au moins 2 PoC (Proof of Concept) par an pour tester de nouvelles technologies."},
+    {"titre": "Transformation des Idées", "texte": "Améliorer le processus d'industrialisation des PoC. Trop d'initiatives restent au stade de prototype."},
+    # Durabilité
+    {"titre": "Alerte Green IT", "texte": "PUE critique (> 1.4). Audit énergétique requis."},
+    {"titre": "Cycle de Vie Matériel", "texte": "Mettre en place une politique de recyclage et d'achat reconditionné pour le matériel IT."},
+    {"titre": "Transition Énergétique", "texte": "Basculer une partie de l'hébergement vers des fournisseurs d'énergie renouvelable."},
+)
+
+# Matrice de Farmer : coordonnées (1-3) de chaque risque sur la grille Probabilité x Impact
+RISQUES = (
+    {"nom": "Vendor Lock-in Critique", "prob": 3, "impact": 3}, # Zone Rouge (3,3)
+    {"nom": "Dépendance Fournisseur", "prob": 2, "impact": 2}, # Zone Jaune (2,2)
+    {"nom": "Obsolescence SI", "prob": 3, "impact": 2}, # Zone Orange (3,2)
+    {"nom": "Non-conformité RSE", "prob": 2, "impact": 3}, # Zone Orange (2,3)
+    {"nom": "Perte Compétitivité", "prob": 2, "impact": 2}, # Zone Jaune (2,2)
+)
+SEUILS_DEP_RISQUE = (25, 10) # % (lock-in critique, dépendance)
+SEUIL_TEMPS_RISQUE = 20 # jours
+SEUIL_PUE_RISQUE = 1.5
+SEUIL_RD_RISQUE = 2 # %
+
+TYPE_FRAP = "FRAP (Problème Majeur)"
+TYPE_FRABOP = "FRABOP (Bonne Pratique)"
+TYPE_AMELIORATION = "Constat d'Amélioration"
+
+DIAGNOSTICS = (
+    {"type": TYPE_FRAP, "message": "Risque critique d'obsolescence. Le SI ne répond pas aux standards de la Dimension 6.", "color": "danger"},
+    {"type": TYPE_AMELIORATION, "message": "Niveau moyen. Des optimisations sont nécessaires pour garantir l'évolution.", "color": "warning"},
+    {"type": TYPE_FRABOP, "message": "Excellente maturité. Le SI est résilient, innovant et durable.", "color": "success"},
+)
 
 # --- LOGIQUE MÉTIER & CALCULS ---
 
+def calculer_scores(inputs):
+    """Calcule les notes des 3 piliers (/5) et le score global (/100) d'un audit."""
+    # Adaptabilité (Inversé pour le temps : moins c'est mieux)
+    score_a = (2 if inputs['dep'] < SEUIL_DEP else 1) + (2 if inputs['temps'] <= SEUILS_TEMPS[0] else (1 if inputs['temps'] <= SEUILS_TEMPS[1] else 0)) + (1 if inputs['arch'] == 'oui' else 0)
+    if inputs['dette'] == 'critique': score_a -= 1 # Pénalité Dette Technique
+
+    # Innovation (Plafonné pour PoC)
+    score_i = (3 if inputs['rd'] >= SEUILS_RD[0] else (1 if inputs['rd'] >= SEUILS_RD[1] else 0)) + min(inputs['poc'], PLAFOND_POC)
+    if inputs['taux_transfo'] > SEUIL_TAUX_TRANSFO: score_i = min(score_i + 1, 5) # Bonus Transformation
+
+    # Durabilité (Green IT)
+    score_d = (3 if inputs['pue'] <= SEUILS_PUE[0] else (1 if inputs['pue'] <= SEUILS_PUE[1] else 0)) + (2 if inputs['rec'] == 'oui' else 0)
+    if inputs['energie_verte'] > SEUIL_ENERGIE_VERTE: score_d = min(score_d + 1, 5) # Bonus Énergie Verte
+
+    # Score Global sur 100
+    global_score = round(((score_a + score_i + score_d) / 15) * 100, 1)
+    return score_a, score_i, score_d, global_score
+
+def calculer_scores_vectorises(df):
+    """
+    Version vectorisée de calculer_scores() + generer_diagnostic() sur un DataFrame
+    dont les colonnes sont les clés d'inputs (dep, temps, arch, ...).
+    Retourne un DataFrame (même index) : scores, type de diagnostic et recommandations sérialisées.
+    """
+    dep = df['dep'].to_numpy(dtype=float)
+    temps = df['temps'].to_numpy(dtype=float)
+    rd = df['rd'].to_numpy(dtype=float)
+    poc = df['poc'].to_numpy(dtype=float)
+    pue = df['pue'].to_numpy(dtype=float)
+    taux_transfo = df['taux_transfo'].to_numpy(dtype=float)
+    energie_verte = df['energie_verte'].to_numpy(dtype=float)
+    arch_oui = (df['arch'] == 'oui').to_numpy()
+    rec_oui = (df['rec'] == 'oui').to_numpy()
+    dette_critique = (df['dette'] == 'critique').to_numpy()
+
+    score_a = (np.where(dep < SEUIL_DEP, 2, 1)
+               + np.select([temps <= SEUILS_TEMPS[0], temps <= SEUILS_TEMPS[1]], [2, 1], 0)
+               + arch_oui - dette_critique)
+    score_i = np.select([rd >= SEUILS_RD[0], rd >= SEUILS_RD[1]], [3, 1], 0) + np.minimum(poc, PLAFOND_POC)
+    score_i = np.minimum(score_i + (taux_transfo > SEUIL_TAUX_TRANSFO), 5)
+    score_d = np.select([pue <= SEUILS_PUE[0], pue <= SEUILS_PUE[1]], [3, 1], 0) + 2 * rec_oui
+    score_d = np.minimum(score_d + (energie_verte > SEUIL_ENERGIE_VERTE), 5)
+
+    global_score = np.round((score_a + score_i + score_d) / 15 * 100, 1)
+    diagnostic_type = np.select([global_score <= SEUIL_FRAP, global_score >= SEUIL_FRABOP], [TYPE_FRAP, TYPE_FRABOP], TYPE_AMELIORATION)
+
+    # Une colonne booléenne par recommandation, dans l'ordre de RECOMMANDATIONS
+    masques = np.column_stack([
+        score_a < SEUIL_RECO_PILIER, (df['arch'] == 'non').to_numpy(), dette_critique,
+        score_i < SEUIL_RECO_PILIER, poc < SEUIL_RECO_POC, taux_transfo < SEUIL_RECO_TRANSFO,
+        score_d < SEUIL_RECO_PILIER, (df['rec'] == 'non').to_numpy(), energie_verte < SEUIL_RECO_ENERGIE,
+    ])
+    # Au plus 2^9 combinaisons : on sérialise une fois par combinaison distincte
+    codes = masques.astype(np.int64) @ (1 << np.arange(len(RECOMMANDATIONS)))
+    uniques, inverse = np.unique(codes, return_inverse=True)
+    textes = np.array([str([r for k, r in enumerate(RECOMMANDATIONS) if code >> k & 1]) for code in uniques], dtype=object)
+
+    return pd.DataFrame({
+        'score_adaptabilite': score_a.astype(float),
+        'score_innovation': score_i.astype(float),
+        'score_durabilite': score_d.astype(float),
+        'score_global': global_score,
+        'diagnostic_type': diagnostic_type,
+        'recommandations': textes[inverse.reshape(-1)],
+    }, index=df.index)
+
+
+# Schéma du fichier CSV d'import : clé d'inputs -> colonne CSV, type, valeur par défaut (colonne absente
+# ou cellule vide), bornes numériques ou modalités catégorielles
+ColonneImport = namedtuple('ColonneImport', ['colonne', 'type', 'defaut', 'bornes', 'modalites'])
+
+OUI_NON = ('oui', 'non')
+NIVEAUX_DETTE = ('faible', 'moyenne', 'critique')
+
+SCHEMA_IMPORT = {
+    'dep': ColonneImport('dep_fournisseur', 'float64', 0.0, (0, 100), None),
+    'temps': ColonneImport('temps_deploy', 'int64', 30, (0, 3650), None), # jours (AuditResult : entier 32 bits)
+    'arch': ColonneImport('arch_modulaire', 'category', 'non', None, OUI_NON),
+    'rd': ColonneImport('budget_rd', 'float64', 0.0, (0, 100), None),
+    'poc': ColonneImport('nb_poc', 'int64', 0, (0, 1000), None),
+    'pue': ColonneImport('pue', 'float64', 2.0, (1, None), None),
+    'rec': ColonneImport('recyclage', 'category', 'non', None, OUI_NON),
+    'dette': ColonneImport('dette_technique', 'category', 'moyenne', None, NIVEAUX_DETTE),
+    'taux_transfo': ColonneImport('taux_transformation', 'float64', 0.0, (0, 100), None),
+    'energie_verte': ColonneImport('energie_verte', 'float64', 0.0, (0, 100), None),
+}
+# Colonne optionnelle identifiant le site : distingue deux sites aux KPIs identiques
+COLONNE_SITE = 'site'
+
+def valider_kpis(brut):
+    """
+    Convertit et valide selon SCHEMA_IMPORT un DataFrame de textes aux colonnes du schéma
+    (colonne absente ou cellule vide : valeur par défaut).
+    Retourne le DataFrame typé des lignes valides (colonnes d'inputs) et les erreurs par index de ligne.
+    """
+    df = pd.DataFrame(index=brut.index)
+    erreurs = {}
+    for cle, spec in SCHEMA_IMPORT.items():
+        if spec.colonne not in brut.columns:
+            df[cle] = pd.Series(spec.defaut, index=brut.index).astype(spec.type if not spec.modalites else pd.CategoricalDtype(spec.modalites))
+            continue
+
+        texte = brut[spec.colonne].str.strip()
+        vide = texte == ''
+        if spec.modalites:
+            minuscules = texte.str.lower()
+            valeurs = pd.Series(pd.Categorical(minuscules.where(minuscules.isin(spec.modalites)), categories=spec.modalites), index=brut.index)
+            invalide = valeurs.isna() & ~vide
+            motif = f"valeur attendue parmi : {', '.join(spec.modalites)}"
+        else:
+            valeurs = pd.to_numeric(texte, errors='coerce')
+            invalide = valeurs.isna() & ~vide
+            if spec.type == 'int64':
+                invalide |= valeurs.notna() & (valeurs % 1 != 0)
+            minimum, maximum = spec.bornes
+            invalide |= np.isinf(valeurs) | (valeurs < minimum)
+            if maximum is not None:
+                invalide |= valeurs > maximum
+            motif = f"{'entier' if spec.type == 'int64' else 'nombre'} attendu" + (f" entre {minimum} et {maximum}" if maximum is not None else f" >= {minimum}")
+
+        for index in brut.index[invalide]:
+            erreurs.setdefault(index, []).append({'colonne': spec.colonne, 'valeur': brut.at[index, spec.colonne], 'motif': motif})
+        # Cellules vides (et invalides, rejetées ensuite) : valeur par défaut
+        df[cle] = valeurs.fillna(spec.defaut) if spec.modalites else valeurs.where(~invalide & ~vide, spec.defaut)
+
+    rejetees = df.index.isin(list(erreurs))
+    df = df[~rejetees].astype({cle: spec.type for cle, spec in SCHEMA_IMPORT.items() if not spec.modalites})
+    return df, erreurs
+
+def lire_csv_kpis(fichier):
+    """
+    Lit et valide un CSV d'audit multi-sites selon SCHEMA_IMPORT, en une passe au chargement.
+    Retourne le DataFrame typé des lignes valides (colonnes d'inputs) et le rapport d'erreurs.
+    """
+    colonnes = {spec.colonne for spec in SCHEMA_IMPORT.values()} | {COLONNE_SITE}
+    # Lecture en texte des seules colonnes du schéma : la conversion est faite colonne par colonne
+    # dans valider_kpis() pour pouvoir rejeter une ligne au lieu de faire échouer tout le fichier
+    brut = pd.read_csv(fichier, usecols=lambda nom: nom.strip() in colonnes, dtype=str, keep_default_na=False)
+    brut.columns = brut.columns.str.strip()
+    colonnes_absentes = [spec.colonne for spec in SCHEMA_IMPORT.values() if spec.colonne not in brut.columns]
+    if len(colonnes_absentes) == len(SCHEMA_IMPORT):
+        raise ValueError(f"aucune colonne reconnue dans l'en-tête du CSV. Colonnes attendues : {', '.join(colonnes_absentes)}.")
+
+    df, erreurs = valider_kpis(brut)
+    if COLONNE_SITE in brut.columns:
+        sites = brut[COLONNE_SITE].str.strip()
+        df['site'] = sites.where(sites != '', None)
+
+    rapport = {
+        'lignes_lues': len(brut),
+        'lignes_valides': len(df),
+        'colonnes_absentes': colonnes_absentes,
+        # Numéro de ligne du fichier (l'en-tête est la ligne 1)
+        'rejets': [{'ligne': int(index) + 2, 'erreurs': erreurs[index]} for index in sorted(erreurs)],
+    }
+    return df, rapport
+
+def lire_formulaire_kpis(formulaire):
+    """
+    Valide un audit saisi (champs nommés comme les colonnes de Audit) avec les règles du CSV.
+    Retourne (inputs, None) ou (None, erreurs).
+    """
+    brut = pd.DataFrame({SCHEMA_IMPORT[cle].colonne: [formulaire[champ]] for cle, champ in COLONNES_KPI.items() if champ in formulaire}, index=[0])
+    df, erreurs = valider_kpis(brut)
+    if erreurs:
+        # Erreurs rapportées sous le nom des champs du formulaire, pas des colonnes CSV
+        champs = {SCHEMA_IMPORT[cle].colonne: champ for cle, champ in COLONNES_KPI.items()}
+        return None, [{**erreur, 'colonne': champs[erreur['colonne']]} for erreur in erreurs[0]]
+    return inputs_de_ligne(df.iloc[0]), None
+
+def inputs_de_ligne(ligne):
+    """Dictionnaire d'inputs (types Python natifs) d'une ligne validée."""
+    return {cle: ligne[cle].item() if hasattr(ligne[cle], 'item') else ligne[cle] for cle in SCHEMA_IMPORT}
+
+def empreintes_lignes(df, utilisateur):
+    """
+    Empreinte SHA-256 du contenu normalisé de chaque ligne, de l'identifiant de site s'il est fourni
+    et de l'utilisateur qui l'importe (son email : deux utilisateurs peuvent porter le même nom).
+    """
+    colonnes = [df[cle].tolist() for cle in SCHEMA_IMPORT]
+    sites = df['site'].tolist() if 'site' in df else [None] * len(df)
+    return [
+        hashlib.sha256(f"{utilisateur}|{'|'.join(map(str, ligne))}{f'|{site}' if site else ''}".encode('utf-8')).hexdigest()
+        for ligne, site in zip(zip(*colonnes), sites)
+    ]
+
+def empreintes_existantes(empreintes, taille_lot=900):
+    """Retourne celles des empreintes déjà présentes en base (requêtes IN par lots, index unique)."""
+    existantes = set()
+    for i in range(0, len(empreintes), taille_lot):
+        lot = empreintes[i:i + taille_lot]
+        existantes.update(db.session.scalars(db.select(Audit.empreinte).where(Audit.empreinte.in_(lot))))
+    return existantes
+
 def analyser_risques(inputs):
     """
     LOGIQUE MATRICE DE FARMER (PROBABILITÉ x IMPACT)
     Retourne des coordonnées (1-3) pour placer les points sur la grille.
     """
-    risques = []
-
-    # Risque 1 : Vendor Lock-in (Dépendance)
-    if inputs['dep'] > 25:
-        risques.append({
-            "nom": "Vendor Lock-in Critique",
-            "prob": 3, "impact": 3 # Zone Rouge (3,3)
-        })
-    elif inputs['dep'] > 10:
-        risques.append({
-            "nom": "Dépendance Fournisseur",
-            "prob": 2, "impact": 2 # Zone Jaune (2,2)
-        })
-
-    # Risque 2 : Obsolescence (Temps de déploiement)
-    if inputs['temps'] > 20:
-        risques.append({
-            "nom": "Obsolescence SI",
-            "prob": 3, "impact": 2 # Zone Orange (3,2)
-        })
-
-    # Risque 3 : Non-conformité Green IT (PUE)
-    if inputs['pue'] > 1.5:
-        risques.append({
-            "nom": "Non-conformité RSE",
-            "prob": 2, "impact": 3 # Zone Orange (2,3)
-        })
-
-    # Risque 4 : Manque d'Innovation
-    if inputs['rd'] < 2:
-        risques.append({
-            "nom": "Perte Compétitivité",
-            "prob": 2, "impact": 2 # Zone Jaune (2,2)
-        })
-
-    return risques
+    return [RISQUES[k] for k in indices_risques(inputs)]
+
+def indices_risques(inputs):
+    """Indices (dans RISQUES) des risques identifiés pour un audit."""
+    conditions = [
+        # Risque 1 : Vendor Lock-in (Dépendance)
+        inputs['dep'] > SEUILS_DEP_RISQUE[0],
+        SEUILS_DEP_RISQUE[1] < inputs['dep'] <= SEUILS_DEP_RISQUE[0],
+        # Risque 2 : Obsolescence (Temps de déploiement)
+        inputs['temps'] > SEUIL_TEMPS_RISQUE,
+        # Risque 3 : Non-conformité Green IT (PUE)
+        inputs['pue'] > SEUIL_PUE_RISQUE,
+        # Risque 4 : Manque d'Innovation
+        inputs['rd'] < SEUIL_RD_RISQUE,
+    ]
+    return tuple(k for k, actif in enumerate(conditions) if actif)
+
+def masques_risques(df):
+    """
+    Version vectorisée d'analyser_risques() : matrice booléenne (sites x RISQUES)
+    évaluée en une passe sur un DataFrame aux colonnes d'inputs (dep, temps, pue, rd).
+    """
+    dep = df['dep'].to_numpy(dtype=float)
+    return np.column_stack([
+        dep > SEUILS_DEP_RISQUE[0],
+        (dep > SEUILS_DEP_RISQUE[1]) & (dep <= SEUILS_DEP_RISQUE[0]),
+        df['temps'].to_numpy(dtype=float) > SEUIL_TEMPS_RISQUE,
+        df['pue'].to_numpy(dtype=float) > SEUIL_PUE_RISQUE,
+        df['rd'].to_numpy(dtype=float) < SEUIL_RD_RISQUE,
+    ])
+
+class PortefeuilleRisques:
+    """
+    Agrégat des risques de Farmer sur un ensemble de sites.
+    Les compteurs sont additifs : on peut alimenter l'agrégat lot par lot.
+    """
+    def __init__(self):
+        self.sites = 0
+        self.sites_a_risque = 0
+        self.sites_non_evaluables = 0 # Audits sans KPIs bruts : exclus des compteurs
+        self.par_risque = np.zeros(len(RISQUES), dtype=np.int64)
+
+    def ajouter(self, df):
+        masques = masques_risques(df)
+        self.sites += len(masques)
+        self.sites_a_risque += int(masques.any(axis=1).sum())
+        self.par_risque += masques.sum(axis=0)
+
+    def matrice(self):
+        """Matrice 3x3 des occurrences : matrice[impact - 1][prob - 1]."""
+        matrice = np.zeros((3, 3), dtype=np.int64)
+        for risque, nombre in zip(RISQUES, self.par_risque):
+            matrice[risque['impact'] - 1, risque['prob'] - 1] += nombre
+        return matrice
+
+    def vers_json(self):
+        return {
+            'sites': self.sites,
+            'sites_a_risque': self.sites_a_risque,
+            'sites_non_evaluables': self.sites_non_evaluables,
+            'matrice': self.matrice().tolist(),
+            'axes': {'lignes': 'impact (1 -> 3)', 'colonnes': 'probabilite (1 -> 3)'},
+            'risques': {r['nom']: int(n) for r, n in zip(RISQUES, self.par_risque)},
+        }
 
 def generer_diagnostic(global_score, s_adapt, s_innov, s_dura, inputs=None):
     """Génère le constat textuel (FRAP/FRABOP) et des recommandations détaillées"""
-    diag = {}
-    if global_score <= 60:
-        diag['type'] = "FRAP (Problème Majeur)"
-        diag['message'] = "Risque critique d'obsolescence. Le SI ne répond pas aux standards de la Dimension 6."
-        diag['color'] = "danger"
-    elif global_score >= 80:
-        diag['type'] = "FRABOP (Bonne Pratique)"
-        diag['message'] = "Excellente maturité. Le SI est résilient, innovant et durable."
-        diag['color'] = "success"
-    else:
-        diag['type'] = "Constat d'Amélioration"
-        diag['message'] = "Niveau moyen. Des optimisations sont nécessaires pour garantir l'évolution."
-        diag['color'] = "warning"
+    diag = dict(DIAGNOSTICS[indice_diagnostic(global_score)])
+    diag['recos'] = [RECOMMANDATIONS[k] for k in indices_recommandations(s_adapt, s_innov, s_dura, inputs)]
+    return diag
 
-    # Recommandations ciblées et étendues
-    recos = []
-    
-    # Adaptabilité
-    if s_adapt < 3: 
-        recos.append({"titre": "Urgence Adaptabilité", "texte": "Réduire la dette technique et le temps de déploiement."})
-    if inputs and inputs.get('arch') == 'non':
-        recos.append({"titre": "Architecture Monolithique", "texte": "Migrer progressivement vers une architecture modulaire (Microservices/API) pour gagner en agilité."})
-    if inputs and inputs.get('dette') == 'critique':
-        recos.append({"titre": "Dette Technique Critique", "texte": "Planifier un sprint de refactoring immédiat. La dette technique freine toute évolution."})
+def indice_diagnostic(global_score):
+    """Indice dans DIAGNOSTICS : FRAP, Constat d'Amélioration ou FRABOP."""
+    if global_score <= SEUIL_FRAP:
+        return 0
+    if global_score >= SEUIL_FRABOP:
+        return 2
+    return 1
+
+def indices_recommandations(s_adapt, s_innov, s_dura, inputs=None):
+    """Indices (dans RECOMMANDATIONS) des recommandations ciblées et étendues."""
+    conditions = [
+        # Adaptabilité
+        s_adapt < SEUIL_RECO_PILIER,
+        bool(inputs) and inputs.get('arch') == 'non',
+        bool(inputs) and inputs.get('dette') == 'critique',
+        # Innovation
+        s_innov < SEUIL_RECO_PILIER,
+        bool(inputs) and inputs.get('poc', 0) < SEUIL_RECO_POC,
+        bool(inputs) and inputs.get('taux_transfo', 0) < SEUIL_RECO_TRANSFO,
+        # Durabilité
+        s_dura < SEUIL_RECO_PILIER,
+        bool(inputs) and inputs.get('rec') == 'non',
+        bool(inputs) and inputs.get('energie_verte', 0) < SEUIL_RECO_ENERGIE,
+    ]
+    return tuple(k for k, active in enumerate(conditions) if active)
 
-    # Innovation
-    if s_innov < 3: 
-        recos.append({"titre": "Déficit Innovation", "texte": "Augmenter le budget R&D (> 5%)."})
-    if inputs and inputs.get('poc', 0) < 2:
-        recos.append({"titre": "Culture de l'Expérimentation", "texte": "Lancer au moins 2 PoC (Proof of Concept) par an pour tester de nouvelles technologies."})
-    if inputs and inputs.get('taux_transfo', 0) < 20:
-        recos.append({"titre": "Transformation des Idées", "texte": "Améliorer le processus d'industrialisation des PoC. Trop d'initiatives restent au stade de prototype."})
+# --- SIMULATEUR WHAT-IF (FRAP -> FRABOP) ---
 
-    # Durabilité
-    if s_dura < 3: 
-        recos.append({"titre": "Alerte Green IT", "texte": "PUE critique (> 1.4). Audit énergétique requis."})
-    if inputs and inputs.get('rec') == 'non':
-        recos.append({"titre": "Cycle de Vie Matériel", "texte": "Mettre en place une politique de recyclage et d'achat reconditionné pour le matériel IT."})
-    if inputs and inputs.get('energie_verte', 0) < 30:
-        recos.append({"titre": "Transition Énergétique", "texte": "Basculer une partie de l'hébergement vers des fournisseurs d'énergie renouvelable."})
-    
-    diag['recos'] = recos
-    return diag
+# Axes de la grille, regroupés par pilier (les notes des piliers sont indépendantes)
+AXES_SIMULATION = (
+    ('score_adaptabilite', ('dep', 'temps', 'arch', 'dette')),
+    ('score_innovation', ('rd', 'poc', 'taux_transfo')),
+    ('score_durabilite', ('pue', 'rec', 'energie_verte')),
+)
+# Coût d'un changement = écart / échelle (une unité d'effort par échelle)
+ECHELLES_SIMULATION = {
+    'dep': 10, 'temps': 7, 'arch': 1, 'dette': 1,
+    'rd': 1, 'poc': 1, 'taux_transfo': 10,
+    'pue': 0.1, 'rec': 1, 'energie_verte': 10
+}
+MAX_POINTS_SIMULATION = 20_000_000
+
+def valeurs_candidates(cle, actuel, pas):
+    """Valeurs explorées pour un KPI : de la valeur actuelle vers la meilleure valeur, seuils inclus."""
+    if cle in ('arch', 'rec'):
+        return [actuel] if actuel == 'oui' else [actuel, 'oui']
+    if cle == 'dette':
+        return [actuel, 'moyenne'] if actuel == 'critique' else [actuel]
+
+    # (meilleure valeur, valeurs franchissant les seuils de scoring)
+    bornes = {
+        'dep': (0, [SEUIL_DEP - 0.1]),
+        'temps': (1, list(SEUILS_TEMPS)),
+        'rd': (2 * SEUILS_RD[0], list(SEUILS_RD)),
+        'poc': (PLAFOND_POC, []),
+        'pue': (1.0, list(SEUILS_PUE)),
+        'taux_transfo': (100, [SEUIL_TAUX_TRANSFO + 1]),
+        'energie_verte': (100, [SEUIL_ENERGIE_VERTE + 1]),
+    }
+    cible, seuils = bornes[cle]
+    bas, haut = sorted((actuel, cible))
+    valeurs = np.concatenate([np.linspace(actuel, cible, pas), [v for v in seuils if bas <= v <= haut]])
+    valeurs = np.round(valeurs) if cle in ('temps', 'poc') else np.round(valeurs, 2)
+    return np.unique(np.append(valeurs, actuel))
+
+def taille_grille(inputs, pas):
+    """Nombre de points de la grille explorée par simuler() pour ce pas."""
+    return int(np.prod([len(valeurs_candidates(cle, inputs[cle], pas)) for _, cles in AXES_SIMULATION for cle in cles]))
+
+def simuler(inputs, pas=5, top=3, poids=None):
+    """
+    Évalue en une passe vectorisée une grille dense de variations des KPIs autour d'un audit
+    et retourne, pour chaque seuil (sortie de FRAP, FRABOP), les changements les moins coûteux.
+    Le pas est réduit si nécessaire pour que la grille tienne dans MAX_POINTS_SIMULATION.
+    """
+    poids = poids or {}
+    while pas > 2 and taille_grille(inputs, pas) > MAX_POINTS_SIMULATION:
+        pas -= 1
+    axes = []
+    grilles = []
+    for pilier, cles in AXES_SIMULATION:
+        valeurs = [valeurs_candidates(cle, inputs[cle], pas) for cle in cles]
+        # Sous-grille du pilier : les autres KPIs restent à leur valeur actuelle
+        sous_grille = pd.MultiIndex.from_product(valeurs, names=cles).to_frame(index=False)
+        for cle, valeur in inputs.items():
+            if cle not in cles:
+                sous_grille[cle] = valeur
+        notes = calculer_scores_vectorises(sous_grille)[pilier].to_numpy().astype(np.int8)
+        grilles.append(notes.reshape([len(v) for v in valeurs]))
+        axes.extend(zip(cles, valeurs))
+
+    forme = tuple(len(valeurs) for _, valeurs in axes)
+    nb_points = int(np.prod(forme))
+    if nb_points > MAX_POINTS_SIMULATION:
+        raise ValueError(f"Grille trop grande ({nb_points} points, maximum {MAX_POINTS_SIMULATION}). Réduisez 'pas'.")
+
+    def diffuser(tableau, debut):
+        """Place les axes de `tableau` à partir de la position `debut` de la grille complète."""
+        return tableau.reshape((1,) * debut + tableau.shape + (1,) * (len(forme) - debut - tableau.ndim))
+
+    # Somme des 3 notes (/15) sur toute la grille, par diffusion (broadcasting)
+    total = np.zeros(forme, dtype=np.int8)
+    debut = 0
+    for notes in grilles:
+        total = total + diffuser(notes, debut)
+        debut += notes.ndim
+
+    cout = np.zeros(forme, dtype=np.float32)
+    for k, (cle, valeurs) in enumerate(axes):
+        if isinstance(inputs[cle], str):
+            ecarts = np.array([0.0 if v == inputs[cle] else 1.0 for v in valeurs])
+        else:
+            ecarts = np.abs(np.asarray(valeurs, dtype=float) - inputs[cle])
+        ecarts = ecarts / ECHELLES_SIMULATION[cle] * float(poids.get(cle, 1))
+        cout = cout + diffuser(ecarts.astype(np.float32), k)
+
+    def global_de(somme):
+        return round((somme / 15) * 100, 1)
+
+    notes_actuelles = calculer_scores(inputs)
+    cibles = {
+        'sortie_frap': lambda g: g > SEUIL_FRAP,
+        'frabop': lambda g: g >= SEUIL_FRABOP,
+    }
+    resultats = {}
+    for nom, atteint in cibles.items():
+        # Le score global croît avec la somme des notes : un seuil sur la somme suffit
+        sommes_ok = [somme for somme in range(int(total.min()), int(total.max()) + 1) if atteint(global_de(somme))]
+        if not sommes_ok:
+            resultats[nom] = []
+            continue
+        couts = np.where(total >= sommes_ok[0], cout, np.inf).ravel()
+        k = min(top, int(np.isfinite(couts).sum()))
+        meilleurs = np.argpartition(couts, k - 1)[:k]
+        meilleurs = meilleurs[np.argsort(couts[meilleurs])]
+
+        chemins = []
+        for indice in meilleurs:
+            coordonnees = np.unravel_index(indice, forme)
+            changements = {}
+            for (cle, valeurs), position in zip(axes, coordonnees):
+                valeur = valeurs[position]
+                if valeur != inputs[cle]:
+                    changements[cle] = {'de': inputs[cle], 'a': valeur if isinstance(valeur, str) else type(inputs[cle])(valeur)}
+            chemins.append({
+                'changements': changements,
+                'score_global': global_de(int(total.flat[indice])),
+                'cout': round(float(couts[indice]), 3),
+            })
+        resultats[nom] = chemins
+
+    return {
+        'actuel': {'scores_radar': list(notes_actuelles[:3]), 'global': notes_actuelles[3]},
+        'pas': pas,
+        'points_evalues': nb_points,
+        'chemins': resultats,
+    }
+
+# --- RÉSULTAT D'AUDIT (TYPE COMPACT) ---
+
+def _indice(modalites, valeur):
+    """Code d'une modalité catégorielle (255 si absente) ; une valeur inconnue ne peut pas être sérialisée."""
+    if valeur is None:
+        return 255
+    if valeur not in modalites:
+        raise ValueError(f"Modalité inconnue : {valeur!r} (attendu : {', '.join(modalites)})")
+    return modalites.index(valeur)
+
+def _modalite(modalites, code):
+    return modalites[code] if code < len(modalites) else None
+
+class AuditResult:
+    """
+    Résultat d'un audit. Le diagnostic, les recommandations et les risques sont des indices
+    dans les catalogues statiques (DIAGNOSTICS, RECOMMANDATIONS, RISQUES) : aucun texte n'est copié.
+    Sérialisation binaire compacte (vers_binaire / depuis_binaire) pour la session.
+    """
+    __slots__ = ('scores_radar', 'global_score', 'diagnostic', 'recos', 'risques', 'jour', 'user', 'email',
+                 'dep', 'temps', 'arch', 'rd', 'poc', 'pue', 'rec', 'dette', 'taux_transfo', 'energie_verte')
+
+    # version, notes A/I/D, score global x10, diagnostic, masque recos, masque risques, jour (ordinal),
+    # KPIs (dep, temps, rd, poc, pue, taux_transfo, energie_verte, arch, rec, dette), longueurs user/email
+    _FORMAT = struct.Struct('<B3bhBHBIdididddBBBHH')
+    _VERSION = 1
+
+    def __init__(self, **champs):
+        for nom in self.__slots__:
+            setattr(self, nom, champs[nom])
+
+    @classmethod
+    def calculer(cls, inputs, user, email):
+        """Calcule scores, diagnostic et risques d'un audit à partir de ses KPIs bruts."""
+        score_a, score_i, score_d, global_score = calculer_scores(inputs)
+        return cls(
+            scores_radar=(score_a, score_i, score_d),
+            global_score=global_score,
+            diagnostic=indice_diagnostic(global_score),
+            recos=indices_recommandations(score_a, score_i, score_d, inputs),
+            risques=indices_risques(inputs), # Matrice de Farmer
+            jour=date.today().toordinal(),
+            user=user, email=email,
+            **{cle: inputs[cle] for cle in SCHEMA_IMPORT}
+        )
+
+    def inputs(self):
+        return {cle: getattr(self, cle) for cle in SCHEMA_IMPORT}
+
+    def vers_binaire(self):
+        masque_recos = sum(1 << k for k in self.recos)
+        masque_risques = sum(1 << k for k in self.risques)
+        user = (self.user or '').encode('utf-8')
+        email = (self.email or '').encode('utf-8')
+        return self._FORMAT.pack(
+            self._VERSION, *self.scores_radar, round(self.global_score * 10), self.diagnostic, masque_recos, masque_risques, self.jour,
+            self.dep, self.temps, self.rd, self.poc, self.pue, self.taux_transfo, self.energie_verte,
+            _indice(OUI_NON, self.arch), _indice(OUI_NON, self.rec), _indice(NIVEAUX_DETTE, self.dette),
+            len(user), len(email)
+        ) + user + email
+
+    @classmethod
+    def depuis_binaire(cls, donnees):
+        (version, score_a, score_i, score_d, global_x10, diagnostic, masque_recos, masque_risques, jour,
+         dep, temps, rd, poc, pue, taux_transfo, energie_verte, arch, rec, dette,
+         longueur_user, longueur_email) = cls._FORMAT.unpack_from(donnees)
+        if version != cls._VERSION:
+            raise ValueError(f"Version de sérialisation inconnue : {version}")
+        debut = cls._FORMAT.size
+        return cls(
+            scores_radar=(score_a, score_i, score_d),
+            global_score=global_x10 / 10,
+            diagnostic=diagnostic,
+            recos=tuple(k for k in range(len(RECOMMANDATIONS)) if masque_recos >> k & 1),
+            risques=tuple(k for k in range(len(RISQUES)) if masque_risques >> k & 1),
+            jour=jour,
+            user=donnees[debut:debut + longueur_user].decode('utf-8'),
+            email=donnees[debut + longueur_user:debut + longueur_user + longueur_email].decode('utf-8'),
+            dep=dep, temps=temps, arch=_modalite(OUI_NON, arch),
+            rd=rd, poc=poc,
+            pue=pue, rec=_modalite(OUI_NON, rec),
+            dette=_modalite(NIVEAUX_DETTE, dette), taux_transfo=taux_transfo, energie_verte=energie_verte
+        )
+
+    def vers_dict(self):
+        """Vue dictionnaire utilisée par les templates et le rapport PDF."""
+        return {
+            'scores_radar': list(self.scores_radar),
+            'global': self.global_score,
+            'diag': {**DIAGNOSTICS[self.diagnostic], 'recos': [RECOMMANDATIONS[k] for k in self.recos]},
+            'risques': [RISQUES[k] for k in self.risques],
+            'date': date.fromordinal(self.jour).strftime("%d/%m/%Y"),
+            'user': self.user,
+            'email': self.email,
+            # Données Brutes pour le Rapport
+            **self.inputs()
+        }
+
+def audit_en_session():
+    """Dernier audit de la session (None si absent ou au format d'une version antérieure)."""
+    donnees = session.get('last_audit')
+    if not isinstance(donnees, bytes):
+        return None
+    try:
+        return AuditResult.depuis_binaire(donnees)
+    except (struct.error, ValueError):
+        return None
 
 # --- FONCTION D'ENVOI AUTOMATISÉE N8N ---
-def envoyer_alerte_n8n(data_audit):
+def envoyer_alerte_n8n(resultat):
     """
-    Envoie les données de l'audit à n8n via un Webhook.
+    Envoie les données de l'audit (AuditResult) à n8n via un Webhook.
     """
     # 1. VOTRE URL N8N SPÉCIFIQUE
-    N8N_WEBHOOK_URL = "https://amineboubou12.app.n8n.cloud/webhook-test/audit-alert"
+    N8N_WEBHOOK_URL = app.config['N8N_WEBHOOK_URL']
     
     print(f"--- Tentative d'envoi vers n8n (URL: {N8N_WEBHOOK_URL}) ---")
     
@@ -163,34 +783,25 @@ def envoyer_alerte_n8n(data_audit):
     # Ajout de l'email pour le coaching IA
     payload = {
         "timestamp": datetime.now().isoformat(),
-        "auditeur": data_audit.get('user', 'Inconnu'),
-        "email": data_audit.get('email', 'non-renseigne'), # Pour l'envoi d'email
-        "score_global": data_audit['global'],
-        "diagnostic_type": data_audit['diag']['type'],
-        "message": data_audit['diag']['message'],
+        "auditeur": resultat.user or 'Inconnu',
+        "email": resultat.email or 'non-renseigne', # Pour l'envoi d'email
+        "score_global": resultat.global_score,
+        "diagnostic_type": DIAGNOSTICS[resultat.diagnostic]['type'],
+        "message": DIAGNOSTICS[resultat.diagnostic]['message'],
         "scores_detailles": {
-            "adaptabilite": data_audit['scores_radar'][0],
-            "innovation": data_audit['scores_radar'][1],
-            "durabilite": data_audit['scores_radar'][2]
+            "adaptabilite": resultat.scores_radar[0],
+            "innovation": resultat.scores_radar[1],
+            "durabilite": resultat.scores_radar[2]
         },
-        "recommandations": [r['titre'] for r in data_audit['diag'].get('recos', [])],
-        "nombre_risques": len(data_audit.get('risques', [])),
+        "recommandations": [RECOMMANDATIONS[k]['titre'] for k in resultat.recos],
+        "nombre_risques": len(resultat.risques),
         # Ajout des données brutes manquantes pour l'IA n8n
-        "rd": data_audit.get('rd'),
-        "pue": data_audit.get('pue'),
-        "dette": data_audit.get('dette'),
-        "dep": data_audit.get('dep'),
-        "temps": data_audit.get('temps'),
-        "arch": data_audit.get('arch'),
-        "poc": data_audit.get('poc'),
-        "rec": data_audit.get('rec'),
-        "taux_transfo": data_audit.get('taux_transfo'),
-        "energie_verte": data_audit.get('energie_verte')
+        **resultat.inputs()
     }
     
     try:
         # 3. Envoi réel
-        response = requests.post(N8N_WEBHOOK_URL, json=payload)
+        response = requests.post(N8N_WEBHOOK_URL, json=payload, timeout=app.config['N8N_TIMEOUT'])
         
         if response.status_code == 200:
             print("✅ SUCCÈS : n8n a bien reçu les données !")
@@ -217,7 +828,9 @@ def generer_image_radar(scores):
 
     scores_closed = scores + scores[:1] # Fermer la boucle
 
-    fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
+    # API objet (sans pyplot) : rendu sûr en parallèle, threads comme processus
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot(polar=True)
     
     # Couleurs personnalisées pour le PDF (Nouveau Vert Tech)
     ax.plot(angles, scores_closed, linewidth=2, linestyle='solid', color='#10B981') # Nouveau Vert
@@ -229,32 +842,32 @@ def generer_image_radar(scores):
     
     # Sauvegarde en mémoire
     img_io = io.BytesIO()
-    plt.savefig(img_io, format='png', bbox_inches='tight', transparent=True)
+    fig.savefig(img_io, format='png', bbox_inches='tight', transparent=True)
     img_io.seek(0)
-    plt.close()
     return img_io
 
 def generer_image_farmer(risques):
     """
     Génère la Matrice de Farmer (3x3) avec les points de risque.
     """
-    fig, ax = plt.subplots(figsize=(6, 6))
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot()
     
     # Fond coloré (Zones) - Couleurs plus douces
     # Zone Verte (Faible)
-    ax.add_patch(plt.Rectangle((1, 1), 1, 1, color='#E8F5E9', alpha=0.9)) # (1,1)
-    ax.add_patch(plt.Rectangle((2, 1), 1, 1, color='#E8F5E9', alpha=0.9)) # (2,1)
-    ax.add_patch(plt.Rectangle((1, 2), 1, 1, color='#E8F5E9', alpha=0.9)) # (1,2)
+    ax.add_patch(Rectangle((1, 1), 1, 1, color='#E8F5E9', alpha=0.9)) # (1,1)
+    ax.add_patch(Rectangle((2, 1), 1, 1, color='#E8F5E9', alpha=0.9)) # (2,1)
+    ax.add_patch(Rectangle((1, 2), 1, 1, color='#E8F5E9', alpha=0.9)) # (1,2)
     
     # Zone Jaune (Moyen)
-    ax.add_patch(plt.Rectangle((3, 1), 1, 1, color='#FFFDE7', alpha=0.9)) # (3,1)
-    ax.add_patch(plt.Rectangle((2, 2), 1, 1, color='#FFFDE7', alpha=0.9)) # (2,2)
-    ax.add_patch(plt.Rectangle((1, 3), 1, 1, color='#FFFDE7', alpha=0.9)) # (1,3)
+    ax.add_patch(Rectangle((3, 1), 1, 1, color='#FFFDE7', alpha=0.9)) # (3,1)
+    ax.add_patch(Rectangle((2, 2), 1, 1, color='#FFFDE7', alpha=0.9)) # (2,2)
+    ax.add_patch(Rectangle((1, 3), 1, 1, color='#FFFDE7', alpha=0.9)) # (1,3)
     
     # Zone Rouge (Fort)
-    ax.add_patch(plt.Rectangle((3, 2), 1, 1, color='#FFEBEE', alpha=0.9)) # (3,2)
-    ax.add_patch(plt.Rectangle((2, 3), 1, 1, color='#FFEBEE', alpha=0.9)) # (2,3)
-    ax.add_patch(plt.Rectangle((3, 3), 1, 1, color='#FFEBEE', alpha=0.9)) # (3,3)
+    ax.add_patch(Rectangle((3, 2), 1, 1, color='#FFEBEE', alpha=0.9)) # (3,2)
+    ax.add_patch(Rectangle((2, 3), 1, 1, color='#FFEBEE', alpha=0.9)) # (2,3)
+    ax.add_patch(Rectangle((3, 3), 1, 1, color='#FFEBEE', alpha=0.9)) # (3,3)
 
     # Configuration des axes
     ax.set_xlim(1, 4)
@@ -277,14 +890,44 @@ def generer_image_farmer(risques):
         ax.text(x, y+0.15, r['nom'], fontsize=8, ha='center', color='#424242')
 
     img_io = io.BytesIO()
-    plt.savefig(img_io, format='png', bbox_inches='tight', transparent=True)
+    fig.savefig(img_io, format='png', bbox_inches='tight', transparent=True)
     img_io.seek(0)
-    plt.close()
     return img_io
 
-def get_ai_response(msg, context=None):
-    """Chatbot Intelligent via OpenAI avec Contexte Audit"""
-    if not client: return "Erreur : Clé API non configurée dans le fichier .env"
+def generer_image_heatmap(portefeuille):
+    """
+    Génère la Matrice de Farmer agrégée d'un portefeuille :
+    chaque case affiche le nombre d'occurrences de risques sur l'ensemble des sites.
+    """
+    matrice = portefeuille.matrice()
+    fig = Figure(figsize=(6, 6))
+    ax = fig.add_subplot()
+
+    # Même convention que generer_image_farmer : Impact en X, Probabilité en Y
+    ax.imshow(matrice.T, origin='lower', cmap='Reds', extent=(1, 4, 1, 4), vmin=0, vmax=max(int(matrice.max()), 1))
+    for impact in range(3):
+        for prob in range(3):
+            ax.text(impact + 1.5, prob + 1.5, str(matrice[impact, prob]), ha='center', va='center', fontsize=14, color='#424242')
+
+    ax.set_xticks([1.5, 2.5, 3.5])
+    ax.set_xticklabels(['Faible', 'Moyen', 'Fort'], color='#616161')
+    ax.set_yticks([1.5, 2.5, 3.5])
+    ax.set_yticklabels(['Faible', 'Moyen', 'Fort'], color='#616161')
+    ax.set_xlabel('Impact', color='#424242')
+    ax.set_ylabel('Probabilité', color='#424242')
+    ax.set_title(f'Matrice de Farmer - Portefeuille ({portefeuille.sites} sites)', color='#2E7D32')
+
+    img_io = io.BytesIO()
+    fig.savefig(img_io, format='png', bbox_inches='tight', transparent=True)
+    img_io.seek(0)
+    return img_io
+
+def get_ai_response(msg, context=None, historique=None, resume=None):
+    """
+    Chatbot Intelligent via OpenAI avec Contexte Audit et mémoire de conversation.
+    Retourne (texte, succes) : en cas d'échec, le texte est le message d'erreur à afficher.
+    """
+    if not client: return "Erreur : Clé API non configurée dans le fichier .env", False
     try:
         system_prompt = (
             "Tu es 'EvoluBot', l'expert senior en audit informatique (SI) spécialisé dans le référentiel AuditS2I, "
@@ -295,14 +938,522 @@ def get_ai_response(msg, context=None):
         
         if context:
             system_prompt += f"\n\nCONTEXTE DE L'AUDIT UTILISATEUR :\n{context}\n\nUtilise ces données pour personnaliser tes réponses."
+        if resume:
+            system_prompt += f"\n\nRÉSUMÉ DES ÉCHANGES PRÉCÉDENTS :\n{resume}"
 
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": msg}],
+            messages=[{"role": "system", "content": system_prompt}, *(historique or []), {"role": "user", "content": msg}],
             temperature=0.7, max_tokens=250
         )
-        return response.choices[0].message.content
-    except Exception as e: return f"Erreur IA : {str(e)}"
+        return response.choices[0].message.content, True
+    except Exception as e: return f"Erreur IA : {str(e)}", False
+
+# --- MÉMOIRE DE CONVERSATION (EVOLUBOT) ---
+
+def estimer_tokens(texte):
+    """Estimation rapide du nombre de tokens (~4 caractères par token)."""
+    return len(texte) // 4 + 1
+
+def resumer_echanges(resume, tours):
+    """Intègre des échanges anciens au résumé de la conversation, borné à CHAT_BUDGET_RESUME tokens."""
+    budget = app.config['CHAT_BUDGET_RESUME']
+    echanges = "\n".join(f"{'Utilisateur' if t['role'] == 'user' else 'EvoluBot'} : {t['content']}" for t in tours)
+    if client:
+        try:
+            response = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": "Tu résumes une conversation d'audit SI en quelques phrases factuelles, "
+                                                  "en conservant les questions posées, les chiffres et les décisions."},
+                    {"role": "user", "content": f"Résumé actuel :\n{resume or '(aucun)'}\n\nNouveaux échanges :\n{echanges}"}
+                ],
+                temperature=0, max_tokens=budget
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"⚠️ Résumé de conversation impossible : {e}")
+    # Repli : on conserve la fin (la plus récente) du texte, tronquée au budget
+    return f"{resume}\n{echanges}".strip()[-budget * 4:]
+
+def charger_conversation():
+    """Conversation EvoluBot de la session (créée au premier message)."""
+    conversation = db.session.get(ConversationChat, session.get('conversation_id', ''))
+    if conversation is None:
+        # Purge des conversations abandonnées depuis plus de 30 jours
+        ConversationChat.query.filter(ConversationChat.date_maj < datetime.utcnow() - timedelta(days=30)).delete()
+        conversation = ConversationChat(id=uuid.uuid4().hex, resume='', tours='[]')
+        db.session.add(conversation)
+        session['conversation_id'] = conversation.id
+    return conversation
+
+def contexte_audit(audit):
+    """Contexte d'audit injecté dans le prompt système."""
+    context_str = (
+        f"Score Global: {audit.global_score}/100. "
+        f"Scores Dimensions: Adaptabilité {audit.scores_radar[0]}/5, "
+        f"Innovation {audit.scores_radar[1]}/5, Durabilité {audit.scores_radar[2]}/5. "
+    )
+    # Ajout des risques majeurs
+    risques_noms = [RISQUES[k]['nom'] for k in audit.risques if RISQUES[k]['impact'] == 3]
+    if risques_noms:
+        context_str += f"Risques Critiques identifiés: {', '.join(risques_noms)}."
+    
+    # Ajout des recommendations (titres seulement)
+    if audit.recos:
+         recos_titres = [RECOMMANDATIONS[k]['titre'] for k in audit.recos]
+         context_str += f" Recommandations proposées: {', '.join(recos_titres)}."
+    return context_str
+
+# --- CACHE DES RAPPORTS PDF ---
+
+# À incrémenter à chaque modification de la mise en page de construire_rapport_pdf()
+PDF_TEMPLATE_VERSION = 1
+
+def cle_rapport(audit_binaire):
+    """
+    Clé stable d'un rapport : contenu de l'audit (AuditResult sérialisé) + version du gabarit + jour courant
+    (la couverture imprime la date du jour, le rapport change donc chaque jour).
+    """
+    empreinte = hashlib.sha256()
+    empreinte.update(audit_binaire)
+    empreinte.update(f"|v{PDF_TEMPLATE_VERSION}|{date.today().isoformat()}".encode('utf-8'))
+    return empreinte.hexdigest()
+
+class CacheRapports:
+    """
+    Cache à deux niveaux des rapports PDF finalisés :
+    - mémoire : LRU borné en octets, propre à chaque worker
+    - disque : répertoire partagé entre les workers, borné en octets (éviction des plus anciens)
+    """
+    DELAI_TEMPORAIRES = 600 # s avant de supprimer un fichier .tmp abandonné
+
+    def __init__(self, dossier, max_memoire, max_disque):
+        self.dossier = dossier
+        self.max_memoire = max_memoire
+        self.max_disque = max_disque
+        self._memoire = OrderedDict()
+        self._taille_memoire = 0
+        self._verrou = threading.Lock()
+
+    def _chemin(self, cle):
+        return os.path.join(self.dossier, f"{cle}.pdf")
+
+    def get(self, cle):
+        with self._verrou:
+            contenu = self._memoire.get(cle)
+            if contenu is not None:
+                self._memoire.move_to_end(cle)
+                return contenu
+
+        chemin = self._chemin(cle)
+        try:
+            with open(chemin, 'rb') as f:
+                contenu = f.read()
+            os.utime(chemin) # Rafraîchit la date pour l'éviction LRU disque
+        except OSError:
+            return None
+
+        self._memoriser(cle, contenu)
+        return contenu
+
+    def set(self, cle, contenu):
+        self._memoriser(cle, contenu)
+        try:
+            os.makedirs(self.dossier, exist_ok=True)
+            # Écriture atomique : un autre worker ne lit jamais un fichier partiel
+            fd, tmp = tempfile.mkstemp(dir=self.dossier, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(contenu)
+                os.replace(tmp, self._chemin(cle))
+            except OSError:
+                os.remove(tmp)
+                raise
+            self._evincer_disque()
+        except OSError as e:
+            print(f"⚠️ Cache PDF disque indisponible : {e}")
+
+    def _memoriser(self, cle, contenu):
+        if len(contenu) > self.max_memoire:
+            return
+        with self._verrou:
+            if cle in self._memoire:
+                self._taille_memoire -= len(self._memoire.pop(cle))
+            self._memoire[cle] = contenu
+            self._taille_memoire += len(contenu)
+            while self._taille_memoire > self.max_memoire:
+                _, ancien = self._memoire.popitem(last=False)
+                self._taille_memoire -= len(ancien)
+
+    def _evincer_disque(self):
+        fichiers = []
+        total = 0
+        for entree in os.scandir(self.dossier):
+            if entree.name.endswith('.tmp'):
+                # Écriture interrompue (arrêt brutal d'un worker) : orpheline au-delà d'un délai raisonnable
+                try:
+                    if time.time() - entree.stat().st_mtime > self.DELAI_TEMPORAIRES:
+                        os.remove(entree.path)
+                except OSError:
+                    pass
+            elif entree.name.endswith('.pdf'):
+                try:
+                    stat = entree.stat()
+                except OSError:
+                    continue # Déjà supprimé par un autre worker
+                fichiers.append((stat.st_mtime, stat.st_size, entree.path))
+                total += stat.st_size
+
+        if total <= self.max_disque:
+            return
+        for _, taille, chemin in sorted(fichiers):
+            try:
+                os.remove(chemin)
+            except OSError:
+                pass
+            total -= taille
+            if total <= self.max_disque:
+                break
+
+cache_rapports = CacheRapports(
+    app.config['PDF_CACHE_DIR'],
+    app.config['PDF_CACHE_MAX_MEMOIRE'],
+    app.config['PDF_CACHE_MAX_DISQUE']
+)
+
+# --- GRAPHIQUES DE PORTEFEUILLE (RENDU PARALLÈLE) ---
+
+GRAPHIQUES_VERSION = 1 # À incrémenter à chaque changement de rendu : invalide le cache
+
+def rendre_graphiques(scores_radar, risques):
+    """Radar et Matrice de Farmer d'un audit, en PNG base64 (exécuté dans un processus du pool)."""
+    return {
+        'radar': base64.b64encode(generer_image_radar(list(scores_radar)).getvalue()).decode('ascii'),
+        'farmer': base64.b64encode(generer_image_farmer([RISQUES[k] for k in risques]).getvalue()).decode('ascii'),
+    }
+
+class CacheGraphiques:
+    """LRU mémoire borné en nombre de rendus, propre à chaque worker."""
+    def __init__(self, max_entrees):
+        self.max_entrees = max_entrees
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def get(self, cle):
+        with self._verrou:
+            images = self._entrees.get(cle)
+            if images is not None:
+                self._entrees.move_to_end(cle)
+            return images
+
+    def set(self, cle, images):
+        with self._verrou:
+            self._entrees[cle] = images
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.max_entrees:
+                self._entrees.popitem(last=False)
+
+cache_graphiques = CacheGraphiques(app.config['GRAPHIQUES_CACHE_MAX'])
+_pool_graphiques = None
+
+def pool_graphiques():
+    """
+    Pool de processus de rendu, créé au premier usage (donc après le fork des workers gunicorn).
+    Les processus du pool sont créés par fork : sûr dans un worker mono-thread (gunicorn --worker-class sync),
+    mais un fork depuis un worker multi-thread (gthread, serveur de développement) peut hériter d'un verrou
+    tenu par un autre thread et bloquer. Dans ce cas, None : le rendu se fait dans le worker.
+    """
+    global _pool_graphiques
+    if _pool_graphiques is None:
+        if threading.active_count() > 1:
+            return None
+        _pool_graphiques = ProcessPoolExecutor(max_workers=app.config['GRAPHIQUES_PROCESSUS'])
+    return _pool_graphiques
+
+def graphiques_audits(ids, images=True, proprietaires=None):
+    """
+    Données des graphiques (scores radar, score global, diagnostic, risques) des audits `ids`,
+    avec les images PNG si demandé. Les rendus manquants du cache sont calculés en parallèle.
+    `proprietaires` : valeurs de user_email autorisées (None : tous les audits).
+    Retourne ({id: graphique}, [ids absents ou non autorisés]).
+    """
+    colonnes = [Audit.id, Audit.score_adaptabilite, Audit.score_innovation,
+                Audit.score_durabilite, Audit.score_global, Audit.diagnostic_type]
+    kpis = list(COLONNES_KPI)
+    requete = db.select(*colonnes, *[getattr(Audit, COLONNES_KPI[c]) for c in kpis]).where(Audit.id.in_(ids))
+    if proprietaires is not None:
+        requete = requete.where(Audit.user_email.in_(proprietaires))
+
+    graphiques, cles = {}, {}
+    for ligne in db.session.execute(requete):
+        id_audit, score_a, score_i, score_d, global_score, diagnostic_type = ligne[:len(colonnes)]
+        inputs = dict(zip(kpis, ligne[len(colonnes):]))
+        # Audits antérieurs au stockage des KPIs bruts : risques non calculables
+        risques = indices_risques(inputs) if None not in inputs.values() else ()
+        graphiques[id_audit] = {
+            'scores_radar': [score_a, score_i, score_d],
+            'global': global_score,
+            'diagnostic': diagnostic_type,
+            'risques': [RISQUES[k] for k in risques],
+        }
+        # Les images ne dépendent que des notes et des risques : clé de contenu, partagée entre audits identiques
+        # et jamais périmée par un recalcul des scores
+        cles[id_audit] = ((score_a, score_i, score_d, risques, GRAPHIQUES_VERSION), risques)
+
+    if images:
+        manquants = {} # clé de contenu -> (scores, risques, ids) : un seul rendu par contenu distinct
+        for id_audit, (cle, risques) in cles.items():
+            rendu = cache_graphiques.get(cle)
+            if rendu is None:
+                manquants.setdefault(cle, (graphiques[id_audit]['scores_radar'], risques, []))[2].append(id_audit)
+            else:
+                graphiques[id_audit]['images'] = rendu
+
+        if manquants:
+            scores = [m[0] for m in manquants.values()]
+            risques = [m[1] for m in manquants.values()]
+            pool = pool_graphiques() if app.config['GRAPHIQUES_PROCESSUS'] > 1 and len(manquants) > 1 else None
+            if pool is not None:
+                rendus = pool.map(rendre_graphiques, scores, risques,
+                                  chunksize=max(1, len(manquants) // (4 * app.config['GRAPHIQUES_PROCESSUS'])))
+            else:
+                rendus = map(rendre_graphiques, scores, risques)
+            for (cle, (_, _, ids_audits)), rendu in zip(manquants.items(), rendus):
+                cache_graphiques.set(cle, rendu)
+                for id_audit in ids_audits:
+                    graphiques[id_audit]['images'] = rendu
+
+    absents = [i for i in ids if i not in graphiques]
+    return graphiques, absents
+
+# --- CONTRÔLE D'ADMISSION (LIMITATION DE CHARGE) ---
+
+class CreneauxConcurrence:
+    """
+    Créneaux d'exécution simultanée par endpoint, partagés entre workers gunicorn :
+    un créneau = un verrou exclusif (flock) sur un fichier, libéré automatiquement si le worker meurt.
+    """
+    def __init__(self, dossier):
+        self.dossier = dossier
+        self._semaphores = {} # Repli sans fcntl : limite propre à chaque processus
+        self._verrou = threading.Lock()
+
+    def acquerir(self, nom, limite):
+        """Retourne une fonction de libération, ou None si tous les créneaux sont occupés (sans attendre)."""
+        if fcntl is None:
+            with self._verrou:
+                semaphore = self._semaphores.setdefault(nom, threading.BoundedSemaphore(limite))
+            return semaphore.release if semaphore.acquire(blocking=False) else None
+
+        os.makedirs(self.dossier, exist_ok=True)
+        for i in range(limite):
+            fd = os.open(os.path.join(self.dossier, f"{nom}.{i}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            return lambda: os.close(fd) # Fermer le descripteur libère le verrou
+        return None
+
+class SeauxJetons:
+    """
+    Token buckets par client et par endpoint, partagés entre workers dans une base SQLite locale.
+    """
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self._local = threading.local()
+
+    def _connexion(self):
+        connexion = getattr(self._local, 'connexion', None)
+        if connexion is None:
+            os.makedirs(os.path.dirname(self.chemin), exist_ok=True)
+            connexion = sqlite3.connect(self.chemin, timeout=0.5, isolation_level=None)
+            connexion.execute('PRAGMA journal_mode=WAL')
+            connexion.execute('PRAGMA synchronous=OFF')
+            connexion.execute('CREATE TABLE IF NOT EXISTS seaux (cle TEXT PRIMARY KEY, jetons REAL, maj REAL)')
+            self._local.connexion = connexion
+        return connexion
+
+    def consommer(self, cle, debit, rafale):
+        """Consomme un jeton. Retourne 0 si la requête est admise, sinon le délai (s) avant le prochain jeton."""
+        maintenant = time.time()
+        try:
+            connexion = self._connexion()
+            connexion.execute('BEGIN IMMEDIATE')
+            try:
+                ligne = connexion.execute('SELECT jetons, maj FROM seaux WHERE cle = ?', (cle,)).fetchone()
+                jetons = rafale if ligne is None else min(rafale, ligne[0] + (maintenant - ligne[1]) * debit)
+                if jetons < 1:
+                    return (1 - jetons) / debit
+                connexion.execute('INSERT OR REPLACE INTO seaux VALUES (?, ?, ?)', (cle, jetons - 1, maintenant))
+                # Purge occasionnelle des clients inactifs depuis plus d'une heure
+                if random.random() < 0.01:
+                    connexion.execute('DELETE FROM seaux WHERE maj < ?', (maintenant - 3600,))
+                return 0
+            finally:
+                connexion.execute('COMMIT')
+        except sqlite3.Error as e:
+            # Store indisponible : on ne bloque pas le service pour autant
+            print(f"⚠️ Limiteur de débit indisponible : {e}")
+            return 0
+
+creneaux_concurrence = CreneauxConcurrence(app.config['ADMISSION_DIR'])
+seaux_jetons = SeauxJetons(os.path.join(app.config['ADMISSION_DIR'], 'seaux.db'))
+
+def identifiant_client():
+    """
+    Clé de limitation : adresse IP du client, précisée par l'email s'il a été vérifié (Google).
+    Un email simplement déclaré via /auth n'y entre pas : se reconnecter sous un autre nom ne remet pas le compteur à zéro.
+    """
+    adresse = request.remote_addr or 'inconnu'
+    if session.get('email_verifie') and session.get('email'):
+        return f"{adresse}|{session['email'].lower()}"
+    return adresse
+
+def rejet_admission(statut, attente, message):
+    """Rejet immédiat (429 / 503) avec en-tête Retry-After."""
+    if request.path.startswith('/api/'):
+        response = make_response({"error": message}, statut)
+    else:
+        response = make_response(message, statut)
+    response.headers['Retry-After'] = str(max(1, int(attente + 0.999)))
+    return response
+
+def admission(nom):
+    """
+    Décorateur de route : limite de débit par client (429) puis limite de concurrence par endpoint (503),
+    selon app.config['LIMITES_ADMISSION'][nom]. Une réponse en flux garde son créneau jusqu'à sa fermeture.
+    """
+    def decorateur(vue):
+        @wraps(vue)
+        def enveloppe(*args, **kwargs):
+            limites = app.config['LIMITES_ADMISSION'].get(nom)
+            if not app.config['ADMISSION_ACTIVE'] or not limites:
+                return vue(*args, **kwargs)
+
+            attente = seaux_jetons.consommer(f"{nom}:{identifiant_client()}", limites['debit'], limites['rafale'])
+            if attente > 0:
+                return rejet_admission(429, attente, "Trop de requêtes : merci de patienter quelques instants.")
+
+            liberer = creneaux_concurrence.acquerir(nom, limites['concurrence'])
+            if liberer is None:
+                return rejet_admission(503, 1, "Service momentanément saturé : merci de réessayer dans quelques instants.")
+            try:
+                reponse = make_response(vue(*args, **kwargs))
+            except BaseException:
+                liberer()
+                raise
+            if reponse.is_streamed:
+                # Réponse en flux : le créneau reste occupé jusqu'à la fin de l'envoi (fermeture par le serveur WSGI)
+                reponse.call_on_close(liberer)
+            else:
+                liberer()
+            return reponse
+        return enveloppe
+    return decorateur
+
+# --- PROFILAGE DES REQUÊTES ---
+
+class ProfilRequete:
+    """
+    Profil d'une requête : cProfile (.prof), échantillonnage périodique de la pile au format
+    « folded » compatible flamegraph.pl / speedscope (.folded) et allocations tracemalloc (.alloc.txt).
+    """
+    def __init__(self, intervalle):
+        self.intervalle = intervalle
+        self.profil = cProfile.Profile()
+        self.piles = Counter()
+        self.thread_id = threading.get_ident()
+        self._arret = threading.Event()
+        self._echantillonneur = threading.Thread(target=self._echantillonner, daemon=True)
+
+    def demarrer(self):
+        tracemalloc.start()
+        self._echantillonneur.start()
+        self.debut = time.perf_counter()
+        self.profil.enable()
+
+    def _echantillonner(self):
+        while not self._arret.wait(self.intervalle):
+            frame = sys._current_frames().get(self.thread_id)
+            pile = []
+            while frame is not None:
+                code = frame.f_code
+                pile.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}".replace(';', ','))
+                frame = frame.f_back
+            if pile:
+                self.piles[';'.join(reversed(pile))] += 1
+
+    def arreter(self, dossier, nom):
+        self.profil.disable()
+        duree = time.perf_counter() - self.debut
+        self._arret.set()
+        self._echantillonneur.join()
+        instantane = tracemalloc.take_snapshot()
+        _, pic = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        os.makedirs(dossier, exist_ok=True)
+        chemin = os.path.join(dossier, nom)
+        self.profil.dump_stats(f"{chemin}.prof")
+        with open(f"{chemin}.folded", 'w', encoding='utf-8') as f:
+            for pile, nombre in self.piles.items():
+                f.write(f"{pile} {nombre}\n")
+        with open(f"{chemin}.alloc.txt", 'w', encoding='utf-8') as f:
+            f.write(f"Durée : {duree * 1000:.1f} ms\nPic mémoire tracé : {pic / 1024:.1f} Kio\n\n")
+            for statistique in instantane.statistics('lineno')[:25]:
+                f.write(f"{statistique}\n")
+
+_verrou_profilage = threading.Lock() # tracemalloc est global au processus : un profil à la fois
+
+def evincer_profils(dossier, maximum):
+    """Ne conserve que les `maximum` profils les plus récents (chaque profil = .prof, .folded, .alloc.txt)."""
+    profils = []
+    for entree in os.scandir(dossier):
+        if entree.name.endswith('.prof'):
+            try:
+                profils.append((entree.stat().st_mtime, entree.name[:-len('.prof')]))
+            except OSError:
+                continue # Déjà supprimé par un autre worker
+    profils.sort()
+    for _, nom in profils[:max(len(profils) - maximum, 0)]:
+        for extension in ('.prof', '.folded', '.alloc.txt'):
+            try:
+                os.remove(os.path.join(dossier, nom + extension))
+            except OSError:
+                pass
+
+def _demarrer_profilage():
+    secret = app.config['PROFILAGE_SECRET']
+    # Forçage par en-tête réservé aux détenteurs du secret : tracemalloc ralentit tout le worker
+    force = bool(secret) and hmac.compare_digest(request.headers.get('X-Profilage', '').encode(), secret.encode())
+    if not (force or random.random() < app.config['PROFILAGE_TAUX']):
+        return
+    if not _verrou_profilage.acquire(blocking=False):
+        return
+    g.profil = ProfilRequete(app.config['PROFILAGE_INTERVALLE'])
+    g.profil.demarrer()
+
+def _terminer_profilage(response=None):
+    profil = g.pop('profil', None)
+    if profil is None:
+        return response
+    nom = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{request.endpoint or 'inconnu'}_{os.getpid()}"
+    try:
+        profil.arreter(app.config['PROFILAGE_DIR'], nom)
+        evincer_profils(app.config['PROFILAGE_DIR'], app.config['PROFILAGE_MAX_PROFILS'])
+    finally:
+        _verrou_profilage.release()
+    if response is not None:
+        response.headers['X-Profilage'] = nom
+    return response
+
+if app.config['PROFILAGE_ACTIF']:
+    app.before_request(_demarrer_profilage)
+    app.after_request(_terminer_profilage)
+    app.teardown_request(lambda exception: _terminer_profilage()) # Requête interrompue par une exception
 
 # --- ROUTES DE NAVIGATION ---
 
@@ -408,6 +1559,7 @@ def auth_google_callback():
         
     session['user'] = user_info.get('name')
     session['email'] = user_info.get('email')
+    session['email_verifie'] = bool(user_info.get('email_verified')) # Seule identité prouvée (cf. acces_global)
     return redirect(url_for('audit'))
 
 # --- ANCIENNE AUTHENTIFICATION (EMAIL/PASS) ---
@@ -417,6 +1569,7 @@ def auth():
     if request.method == 'POST':
         action = request.form.get('action')
         email = request.form.get('email')
+        session.pop('email_verifie', None) # Email déclaratif : aucun droit étendu
         
         if action == 'register':
             session['user'] = request.form.get('fullname') # Stockage du nom
@@ -433,6 +1586,14 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+def proprietaires_session():
+    """Valeurs de Audit.user_email appartenant à la session : email, et nom affiché des imports plus anciens."""
+    return [v for v in dict.fromkeys((session.get('email'), session.get('user'))) if v]
+
+def acces_global():
+    """Lecture des audits de tous les utilisateurs : email vérifié (Google) listé dans ACCES_GLOBAL."""
+    return bool(session.get('email_verifie')) and (session.get('email') or '').lower() in app.config['ACCES_GLOBAL']
+
 # --- CŒUR DE L'APPLICATION : AUDIT & DASHBOARD ---
 
 @app.route('/audit', methods=['GET', 'POST'])
@@ -440,68 +1601,28 @@ def audit():
     if 'user' not in session: return redirect(url_for('auth'))
     
     if request.method == 'POST':
-        # 1. Récupération des données du formulaire
-        dep = float(request.form.get('dep_fournisseur', 0))
-        temps = int(request.form.get('temps_deploy', 30))
-        arch = request.form.get('arch_modulaire')
-        
-        rd = float(request.form.get('budget_rd', 0))
-        poc = int(request.form.get('nb_poc', 0))
-        
-        pue = float(request.form.get('pue', 2.0))
-        rec = request.form.get('recyclage')
-
-        # Nouveaux KPIs
-        dette = request.form.get('dette_technique', 'moyenne')
-        taux_transfo = float(request.form.get('taux_transformation_poc', 0))
-        energie_verte = float(request.form.get('part_energie_verte', 0))
-
-        # 2. Calcul des Scores (Logique métier)
-        # Adaptabilité (Inversé pour le temps : moins c'est mieux)
-        score_a = (2 if dep < 10 else 1) + (2 if temps <= 7 else (1 if temps <= 15 else 0)) + (1 if arch == 'oui' else 0)
-        if dette == 'critique': score_a -= 1 # Pénalité Dette Technique
-
-        # Innovation (Plafonné pour PoC)
-        score_i = (3 if rd >= 5 else (1 if rd >= 2 else 0)) + min(poc, 2)
-        if taux_transfo > 40: score_i = min(score_i + 1, 5) # Bonus Transformation
+        # 1. Récupération et validation des données du formulaire (mêmes bornes que l'import CSV)
+        inputs, erreurs = lire_formulaire_kpis(request.form)
+        if erreurs:
+            for erreur in erreurs:
+                flash(f"{erreur['colonne']} : {erreur['motif']} (reçu : {erreur['valeur']}).", "error")
+            return redirect(url_for('audit'))
 
-        # Durabilité (Green IT)
-        score_d = (3 if pue <= 1.4 else (1 if pue <= 1.6 else 0)) + (2 if rec == 'oui' else 0)
-        if energie_verte > 50: score_d = min(score_d + 1, 5) # Bonus Énergie Verte
+        # 2. Calcul des Scores, du diagnostic et des risques (Logique métier)
+        resultat = AuditResult.calculer(inputs, session.get('user', 'Anonyme'), session.get('email', 'non-renseigne'))
 
-        # Score Global sur 100
-        global_score = round(((score_a + score_i + score_d) / 15) * 100, 1)
-        
-        # 3. Génération des analyses
-        inputs = {'dep': dep, 'temps': temps, 'arch': arch, 'rd': rd, 'poc': poc, 'pue': pue, 'rec': rec, 'dette': dette, 'taux_transfo': taux_transfo, 'energie_verte': energie_verte}
-        diag = generer_diagnostic(global_score, score_a, score_i, score_d, inputs)
-        
-        risques = analyser_risques(inputs) # Appel à la nouvelle fonction Farmer
-
-        # 4. Stockage en session
-        session['last_audit'] = {
-            'scores_radar': [score_a, score_i, score_d],
-            'global': global_score,
-            'diag': diag,
-            'risques': risques,
-            'date': datetime.now().strftime("%d/%m/%Y"),
-            'user': session.get('user', 'Anonyme'),
-            'email': session.get('email', 'non-renseigne'), # Ajout Email
-            # Données Brutes pour le Rapport
-            'dep': dep, 'temps': temps, 'arch': arch,
-            'rd': rd, 'poc': poc,
-            'pue': pue, 'rec': rec,
-            'dette': dette, 'taux_transfo': taux_transfo, 'energie_verte': energie_verte
-        }
+        # 3. Stockage en session (format binaire compact)
+        session['last_audit'] = resultat.vers_binaire()
         
-        # 5. DÉCLENCHEMENT DE L'AUTOMATISATION N8N
-        envoyer_alerte_n8n(session['last_audit'])
+        # 4. DÉCLENCHEMENT DE L'AUTOMATISATION N8N
+        envoyer_alerte_n8n(resultat)
         
         return redirect(url_for('dashboard'))
 
     return render_template('audit.html')
 
 @app.route('/import_csv', methods=['POST'])
+@admission('import_csv')
 def import_csv():
     if 'file' not in request.files:
         flash("Aucun fichier sélectionné.", "error")
@@ -514,143 +1635,390 @@ def import_csv():
 
     if file:
         try:
-            # Lecture du CSV
-            df = pd.read_csv(file)
-            
-            last_audit_data = None
-            
-            # Itération sur chaque ligne
-            for index, row in df.iterrows():
-                try:
-                    # Extraction des données (avec valeurs par défaut si manquant)
-                    dep = float(row.get('dep_fournisseur', 0))
-                    temps = int(row.get('temps_deploy', 30))
-                    arch = str(row.get('arch_modulaire', 'non')).lower()
-                    
-                    rd = float(row.get('budget_rd', 0))
-                    poc = int(row.get('nb_poc', 0))
-                    
-                    pue = float(row.get('pue', 2.0))
-                    rec = str(row.get('recyclage', 'non')).lower()
-
-                    # Nouveaux KPIs Import
-                    dette = str(row.get('dette_technique', 'moyenne')).lower()
-                    taux_transfo = float(row.get('taux_transformation', 0))
-                    energie_verte = float(row.get('energie_verte', 0))
-
-                    # --- MÊME LOGIQUE DE CALCUL QUE /audit ---
-                    # Adaptabilité
-                    score_a = (2 if dep < 10 else 1) + (2 if temps <= 7 else (1 if temps <= 15 else 0)) + (1 if arch == 'oui' else 0)
-                    if dette == 'critique': score_a -= 1
-
-                    # Innovation
-                    score_i = (3 if rd >= 5 else (1 if rd >= 2 else 0)) + min(poc, 2)
-                    if taux_transfo > 40: score_i = min(score_i + 1, 5)
-
-                    # Durabilité
-                    score_d = (3 if pue <= 1.4 else (1 if pue <= 1.6 else 0)) + (2 if rec == 'oui' else 0)
-                    if energie_verte > 50: score_d = min(score_d + 1, 5)
-
-                    global_score = round(((score_a + score_i + score_d) / 15) * 100, 1)
-                    
-                    inputs = {'dep': dep, 'temps': temps, 'arch': arch, 'rd': rd, 'poc': poc, 'pue': pue, 'rec': rec, 'dette': dette, 'taux_transfo': taux_transfo, 'energie_verte': energie_verte}
-                    diag = generer_diagnostic(global_score, score_a, score_i, score_d, inputs)
-                    
-                    # Création de l'objet Audit pour la BDD
-                    new_audit = Audit(
-                        user_email=session.get('user', 'Anonyme'),
-                        score_adaptabilite=score_a,
-                        score_innovation=score_i,
-                        score_durabilite=score_d,
-                        score_global=global_score,
-                        diagnostic_type=diag['type'],
-                        recommandations=str(diag['recos']),
-                        dette_technique=dette,
-                        taux_transformation_poc=taux_transfo,
-                        part_energie_verte=energie_verte
-                    )
-                    db.session.add(new_audit)
-
-                    # Préparation des données pour la session (on gardera la dernière ligne pour le dashboard)
-                    risques = analyser_risques(inputs)
-
-                    last_audit_data = {
-                        'scores_radar': [score_a, score_i, score_d],
-                        'global': global_score,
-                        'diag': diag,
-                        'risques': risques,
-                        'date': datetime.now().strftime("%d/%m/%Y"),
-                        'user': session.get('user', 'Anonyme'),
-                        'email': session.get('email', 'non-renseigne'), # Ajout Email
-                        # Données Brutes
-                        'dep': dep, 'temps': temps, 'arch': arch,
-                        'rd': rd, 'poc': poc,
-                        'pue': pue, 'rec': rec,
-                        'dette': dette, 'taux_transfo': taux_transfo, 'energie_verte': energie_verte
-                    }
-                
-                except Exception as e:
-                    print(f"Erreur traitement ligne {index}: {e}")
-                    continue # On passe à la ligne suivante en cas d'erreur
-            
-            # Commit unique à la fin pour valider tous les enregistrements
+            # Lecture et validation du CSV selon le schéma d'import
+            df, rapport = lire_csv_kpis(file)
+            for rejet in rapport['rejets']:
+                print(f"Erreur traitement ligne {rejet['ligne']}: {rejet['erreurs']}")
+
+            # Empreinte de contenu : une ligne déjà importée par cet utilisateur est ignorée
+            utilisateur = session.get('user', 'Anonyme')
+            df['empreinte'] = empreintes_lignes(df, session.get('email') or utilisateur)
+            # Lignes identiques dans le même fichier (même site ou sans colonne site) : une seule est conservée
+            rapport['lignes_dupliquees'] = int(df['empreinte'].duplicated().sum())
+            df = df.drop_duplicates('empreinte')
+            nouveaux = df[~df['empreinte'].isin(empreintes_existantes(df['empreinte'].tolist()))]
+            rapport['lignes_nouvelles'] = len(nouveaux)
+            rapport['lignes_deja_importees'] = len(df) - len(nouveaux)
+            print(f"✅ Import terminé. {len(nouveaux)} nouvelle(s) ligne(s), {len(df) - len(nouveaux)} déjà importée(s), "
+                  f"{rapport['lignes_dupliquees']} dupliquée(s), {len(rapport['rejets'])} rejetée(s).")
+
+            if nouveaux.empty:
+                if df.empty:
+                    return reponse_import(rapport, "Aucune donnée valide trouvée dans le CSV.", "error", 'audit', 422)
+                return reponse_import(rapport, "Ce fichier a déjà été importé : aucune nouvelle ligne.", "success", 'dashboard' if audit_en_session() else 'audit')
+
+            # --- MÊME LOGIQUE DE CALCUL QUE /audit, vectorisée sur les seules lignes nouvelles ---
+            enregistrements = pd.concat([nouveaux.rename(columns=COLONNES_KPI), calculer_scores_vectorises(nouveaux)], axis=1)
+            enregistrements['user_email'] = session.get('email') or utilisateur
+            enregistrements['regles_version'] = REGLES_VERSION
+
+            # Dernier audit traité, pour le dashboard : sérialisé avant l'écriture en base
+            resultat = AuditResult.calculer(inputs_de_ligne(nouveaux.iloc[-1]), utilisateur, session.get('email', 'non-renseigne'))
+            dernier_audit = resultat.vers_binaire()
+
+            # Insertion en masse ; un import concurrent du même contenu est ignoré par l'index unique
+            db.session.execute(
+                sqlite_insert(Audit).on_conflict_do_nothing(index_elements=['empreinte']),
+                enregistrements.to_dict('records')
+            )
             db.session.commit()
-            print(f"✅ Import terminé. {index + 1 if 'index' in locals() else 0} lignes traitées.")
-            
-            # Mise à jour de la session avec le dernier audit traité
-            if last_audit_data:
-                session['last_audit'] = last_audit_data
-                envoyer_alerte_n8n(session['last_audit'])
-                flash("Import CSV réussi ! Redirection vers le tableau de bord.", "success")
-                return redirect(url_for('dashboard'))
-            else:
-                flash("Aucune donnée valide trouvée dans le CSV.", "error")
-                return redirect(url_for('audit'))
+
+            session['last_audit'] = dernier_audit
+            envoyer_alerte_n8n(resultat)
+            return reponse_import(rapport, f"Import CSV réussi ! {len(nouveaux)} nouvelle(s) ligne(s) importée(s). Redirection vers le tableau de bord.", "success", 'dashboard')
 
         except Exception as e:
+            db.session.rollback()
             print(f"❌ Erreur Import CSV Global : {e}")
-            flash(f"Erreur lors de l'import : {str(e)}", "error")
-            return redirect(url_for('audit'))
+            return reponse_import({}, f"Erreur lors de l'import : {str(e)}", "error", 'audit', 400)
+
+def signaler_rejets(rapport, maximum=5):
+    """Résume les lignes dupliquées et rejetées dans des messages flash (les premières seulement)."""
+    if rapport.get('lignes_dupliquees'):
+        flash(f"{rapport['lignes_dupliquees']} ligne(s) identique(s) à une autre ligne du fichier ignorée(s) : "
+              f"ajoutez une colonne '{COLONNE_SITE}' pour distinguer des sites aux KPIs identiques.", "error")
+    if not rapport.get('rejets'):
+        return
+    details = "; ".join(
+        f"ligne {rejet['ligne']} ({', '.join(e['colonne'] + ' : ' + e['motif'] for e in rejet['erreurs'])})"
+        for rejet in rapport['rejets'][:maximum]
+    )
+    suite = f" et {len(rapport['rejets']) - maximum} autre(s)" if len(rapport['rejets']) > maximum else ""
+    flash(f"{len(rapport['rejets'])} ligne(s) rejetée(s) : {details}{suite}.", "error")
+
+def reponse_import(rapport, message, categorie, destination, statut=200):
+    """Rapport JSON structuré pour les clients API, sinon messages flash et redirection."""
+    if request.accept_mimetypes.best == 'application/json':
+        return {'message': message, **rapport}, statut
+    signaler_rejets(rapport)
+    flash(message, categorie)
+    return redirect(url_for(destination))
 
 @app.route('/dashboard')
 def dashboard():
-    if 'last_audit' not in session: return redirect(url_for('audit'))
-    return render_template('dashboard.html', data=session['last_audit'])
+    resultat = audit_en_session()
+    if not resultat: return redirect(url_for('audit'))
+    return render_template('dashboard.html', data=resultat.vers_dict())
+
+@app.route('/api/risques/portefeuille', methods=['GET', 'POST'])
+def risques_portefeuille():
+    """
+    Matrice de Farmer agrégée sur un portefeuille de sites.
+    GET : audits stockés de l'utilisateur (filtre ?user= libre en accès global) / POST : fichier CSV multi-sites.
+    ?format=png retourne l'image de la heatmap, sinon JSON.
+    """
+    if 'user' not in session: return {"erreur": "Authentification requise."}, 401
+    if request.method == 'POST':
+        return portefeuille_csv()
+
+    colonnes = ['dep', 'temps', 'pue', 'rd']
+    attributs = [getattr(Audit, COLONNES_KPI[c]) for c in colonnes]
+    if acces_global():
+        filtres = [Audit.user_email == request.args['user']] if request.args.get('user') else []
+    elif request.args.get('user') and request.args['user'] not in proprietaires_session():
+        return {"erreur": "Accès refusé aux audits d'un autre utilisateur."}, 403
+    else:
+        filtres = [Audit.user_email.in_(proprietaires_session())]
+
+    portefeuille = PortefeuilleRisques()
+    # Audits antérieurs au stockage des KPIs bruts : comptés à part (NaN ne déclencherait aucun risque)
+    kpis_complets = db.and_(*[a.isnot(None) for a in attributs])
+    portefeuille.sites_non_evaluables = db.session.scalar(
+        db.select(db.func.count(Audit.id)).where(*filtres, db.not_(kpis_complets)))
+    requete = db.select(*attributs).where(*filtres, kpis_complets)
+    # Lecture par lots : mémoire constante quelle que soit la taille de la table
+    resultat = db.session.execute(requete.execution_options(yield_per=10000))
+    for lot in resultat.partitions():
+        portefeuille.ajouter(pd.DataFrame(lot, columns=colonnes))
+    return reponse_portefeuille(portefeuille)
+
+@admission('portefeuille')
+def portefeuille_csv():
+    """Portefeuille lu depuis un CSV multi-sites (POST), soumis au contrôle d'admission comme l'import."""
+    fichier = request.files.get('file')
+    if not fichier or fichier.filename == '':
+        return {"erreur": "Aucun fichier sélectionné."}, 400
+    try:
+        df, rapport = lire_csv_kpis(fichier)
+    except Exception as e:
+        return {"erreur": f"Fichier CSV illisible : {e}"}, 400
+    portefeuille = PortefeuilleRisques()
+    portefeuille.ajouter(df)
+    return reponse_portefeuille(portefeuille, rapport)
+
+def reponse_portefeuille(portefeuille, rapport=None):
+    if request.args.get('format') == 'png':
+        response = make_response(generer_image_heatmap(portefeuille).getvalue())
+        response.headers['Content-Type'] = 'image/png'
+        return response
+    resultat = portefeuille.vers_json()
+    if rapport:
+        resultat['rejets'] = rapport['rejets']
+    return resultat
+
+@app.route('/api/simulate', methods=['POST'])
+@admission('simulation')
+def simulate_api():
+    """
+    Simulateur what-if : changements minimaux pour franchir les seuils 60 et 80.
+    Corps JSON optionnel : KPIs (dep, temps, ...) remplaçant ceux du dernier audit, 'pas', 'top', 'poids'.
+    """
+    if 'user' not in session: return {"erreur": "Authentification requise."}, 401
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    elif not isinstance(data, dict):
+        return {"erreur": "Le corps JSON doit être un objet."}, 400
+    resultat = audit_en_session()
+    base = resultat.inputs() if resultat else {}
+
+    # KPIs fusionnés validés avec les règles de l'import CSV (bornes, modalités, valeurs finies)
+    brut = pd.DataFrame({spec.colonne: [str(data.get(cle, base.get(cle, spec.defaut)))] for cle, spec in SCHEMA_IMPORT.items()}, index=[0])
+    df, erreurs = valider_kpis(brut)
+    if erreurs:
+        cles = {spec.colonne: cle for cle, spec in SCHEMA_IMPORT.items()}
+        return {"erreur": ' '.join(f"{cles[e['colonne']]} : {e['motif']} (reçu : {e['valeur']})." for e in erreurs[0])}, 400
+    inputs = inputs_de_ligne(df.iloc[0])
+
+    try:
+        poids = data.get('poids') or {}
+        if not isinstance(poids, dict) or not all(
+                cle in SCHEMA_IMPORT and isinstance(p, (int, float)) and not isinstance(p, bool) and 0 <= p < float('inf')
+                for cle, p in poids.items()):
+            raise ValueError("'poids' doit associer des KPIs (dep, temps, ...) à des nombres positifs.")
+        pas = min(max(int(data.get('pas', 5)), 2), 50) # Réduit ensuite par simuler() si la grille est trop grande
+        debut = time.perf_counter()
+        resultat = simuler(inputs, pas=pas, top=min(max(int(data.get('top', 3)), 1), 20), poids=poids)
+    except (TypeError, ValueError, OverflowError) as e:
+        return {"erreur": str(e)}, 400
+
+    resultat['duree_ms'] = round((time.perf_counter() - debut) * 1000, 1)
+    return resultat
 
 @app.route('/api/chat', methods=['POST'])
+@admission('chat_api')
 def chat_api():
     data = request.get_json()
     user_msg = data.get('message')
-    
-    # Construction du contexte si un audit existe
-    context_str = None
+    conversation = charger_conversation()
+
+    # Contexte de l'audit : calculé une fois par audit, puis réutilisé à chaque message
     if 'last_audit' in session:
-        audit = session['last_audit']
-        context_str = (
-            f"Score Global: {audit['global']}/100. "
-            f"Scores Dimensions: Adaptabilité {audit['scores_radar'][0]}/5, "
-            f"Innovation {audit['scores_radar'][1]}/5, Durabilité {audit['scores_radar'][2]}/5. "
-        )
-        # Ajout des risques majeurs
-        if audit.get('risques'):
-            risques_noms = [r['nom'] for r in audit['risques'] if r['impact'] == 3]
-            if risques_noms:
-                context_str += f"Risques Critiques identifiés: {', '.join(risques_noms)}."
-        
-        # Ajout des recommendations (titres seulement)
-        if audit['diag'].get('recos'):
-             recos_titres = [r['titre'] for r in audit['diag']['recos']]
-             context_str += f" Recommandations proposées: {', '.join(recos_titres)}."
+        cle = hashlib.sha256(session['last_audit']).hexdigest() if isinstance(session['last_audit'], bytes) else None
+        if cle != conversation.contexte_cle:
+            audit = audit_en_session()
+            conversation.contexte = contexte_audit(audit) if audit else None
+            conversation.contexte_cle = cle
+    else:
+        conversation.contexte = conversation.contexte_cle = None
+
+    tours = json.loads(conversation.tours)
+    reponse, succes = get_ai_response(user_msg, context=conversation.contexte, historique=tours, resume=conversation.resume)
+
+    # Les messages d'erreur ne sont pas mémorisés
+    if succes:
+        tours += [{"role": "user", "content": user_msg}, {"role": "assistant", "content": reponse}]
+        # Budget de tokens : une fois dépassé, les échanges les plus anciens sont résumés jusqu'au niveau bas,
+        # ce qui laisse de la marge pour plusieurs questions avant le résumé suivant
+        anciens = []
+        if sum(estimer_tokens(t['content']) for t in tours) > app.config['CHAT_BUDGET_TOKENS']:
+            while len(tours) > 2 and sum(estimer_tokens(t['content']) for t in tours) > app.config['CHAT_BUDGET_BAS']:
+                anciens += tours[:2]
+                tours = tours[2:]
+        if anciens:
+            conversation.resume = resumer_echanges(conversation.resume, anciens)
+        conversation.tours = json.dumps(tours, ensure_ascii=False)
+
+    db.session.commit()
+    return {"response": reponse}
+
+@app.route('/api/graphiques', methods=['GET', 'POST'])
+@admission('graphiques')
+def graphiques_api():
+    """
+    Graphiques pré-calculés de plusieurs audits en un seul aller-retour (vues portefeuille).
+    Identifiants : ?ids=1,2,3 ou corps JSON {"ids": [...]} ; ?images=0 pour les seules données.
+    """
+    if 'user' not in session: return {"erreur": "Authentification requise."}, 401
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return {"erreur": "Corps JSON attendu : {\"ids\": [...]}."}, 400
+        ids = data.get('ids')
+    else:
+        ids = request.args.get('ids', '').split(',')
+    try:
+        ids = list(dict.fromkeys(int(i) for i in ids or [] if str(i).strip()))
+    except (TypeError, ValueError):
+        return {"erreur": "Identifiants d'audit invalides."}, 400
+    if not ids:
+        return {"erreur": "Aucun identifiant d'audit fourni."}, 400
+    if len(ids) > app.config['GRAPHIQUES_MAX_AUDITS']:
+        return {"erreur": f"Au plus {app.config['GRAPHIQUES_MAX_AUDITS']} audits par requête."}, 400
+
+    proprietaires = None if acces_global() else proprietaires_session()
+    graphiques, absents = graphiques_audits(ids, images=request.args.get('images', '1') != '0', proprietaires=proprietaires)
+    return {"graphiques": {str(i): graphiques[i] for i in ids if i in graphiques}, "absents": absents}
+
+# --- EXPORT EN MASSE DE L'HISTORIQUE DES AUDITS ---
+
+FORMATS_EXPORT = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+DIAGNOSTICS_EXPORT = {'FRAP': TYPE_FRAP, 'FRABOP': TYPE_FRABOP, 'AMELIORATION': TYPE_AMELIORATION}
+TAILLE_LOT_EXPORT = 5000
+
+class FluxSortie(io.RawIOBase):
+    """Tampon d'écriture vidé après chaque lot : permet de streamer la sortie d'un writer pyarrow."""
+    def __init__(self):
+        super().__init__()
+        self._morceaux = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, donnees):
+        self._morceaux.append(bytes(donnees))
+        self._position += len(donnees)
+        return len(donnees)
+
+    def tell(self):
+        return self._position
+
+    def vider(self):
+        donnees = b''.join(self._morceaux)
+        self._morceaux.clear()
+        return donnees
+
+def schema_arrow(colonnes):
+    """Schéma Arrow équivalent aux colonnes SQLAlchemy exportées."""
+    types = {int: pa.int64(), float: pa.float64(), str: pa.string(), datetime: pa.timestamp('us')}
+    return pa.schema([(c.name, types[c.type.python_type]) for c in colonnes])
+
+def lots_vers_csv(lots, colonnes):
+    tampon = io.StringIO()
+    ecrivain = csv.writer(tampon)
+    ecrivain.writerow([c.name for c in colonnes])
+    for lot in lots:
+        ecrivain.writerows(lot)
+        yield tampon.getvalue()
+        tampon.seek(0)
+        tampon.truncate()
+    yield tampon.getvalue()
+
+def lots_vers_arrow(lots, colonnes, format_sortie):
+    schema = schema_arrow(colonnes)
+    sortie = FluxSortie()
+    if format_sortie == 'parquet':
+        ecrivain = pq.ParquetWriter(sortie, schema)
+    else:
+        ecrivain = pa.ipc.new_stream(sortie, schema)
+    for lot in lots:
+        # Un lot = un RecordBatch (Arrow) ou un row group (Parquet)
+        ecrivain.write_batch(pa.RecordBatch.from_arrays([pa.array(v, type=t) for v, t in zip(zip(*lot), schema.types)], schema=schema))
+        yield sortie.vider()
+    ecrivain.close()
+    yield sortie.vider()
+
+@app.route('/api/audits/export')
+@admission('export_audits')
+def export_audits():
+    """
+    Export en flux de la table Audit, sans la charger en mémoire.
+    Paramètres : format (csv | arrow | parquet), user, debut / fin (AAAA-MM-JJ, inclus), diagnostic (FRAP | FRABOP | AMELIORATION).
+    Seuls les audits de l'utilisateur connecté sont exportés, sauf accès global (filtre user libre).
+    """
+    if 'user' not in session: return {"erreur": "Authentification requise."}, 401
+
+    format_sortie = request.args.get('format', 'csv')
+    if format_sortie not in FORMATS_EXPORT:
+        return {"erreur": f"Format inconnu. Formats disponibles : {', '.join(FORMATS_EXPORT)}."}, 400
+    if format_sortie != 'csv' and pa is None:
+        return {"erreur": "Export colonnaire indisponible : installez pyarrow sur le serveur."}, 501
+
+    colonnes = list(Audit.__table__.columns)
+    requete = db.select(*colonnes).order_by(Audit.id)
+    try:
+        if acces_global():
+            if request.args.get('user'):
+                requete = requete.where(Audit.user_email == request.args['user'])
+        elif request.args.get('user') and request.args['user'] not in proprietaires_session():
+            return {"erreur": "Accès refusé aux audits d'un autre utilisateur."}, 403
+        else:
+            requete = requete.where(Audit.user_email.in_(proprietaires_session()))
+        if request.args.get('debut'):
+            requete = requete.where(Audit.date_audit >= datetime.strptime(request.args['debut'], '%Y-%m-%d'))
+        if request.args.get('fin'):
+            requete = requete.where(Audit.date_audit < datetime.strptime(request.args['fin'], '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        return {"erreur": "Dates attendues au format AAAA-MM-JJ."}, 400
+    if request.args.get('diagnostic'):
+        diagnostic = request.args['diagnostic'].upper()
+        if diagnostic not in DIAGNOSTICS_EXPORT:
+            return {"erreur": f"Diagnostic inconnu. Valeurs possibles : {', '.join(DIAGNOSTICS_EXPORT)}."}, 400
+        requete = requete.where(Audit.diagnostic_type == DIAGNOSTICS_EXPORT[diagnostic])
+
+    def generer():
+        # Curseur côté serveur : les lignes arrivent par lots de TAILLE_LOT_EXPORT
+        resultat = db.session.execute(requete.execution_options(yield_per=TAILLE_LOT_EXPORT))
+        lots = resultat.partitions()
+        if format_sortie == 'csv':
+            for morceau in lots_vers_csv(lots, colonnes):
+                yield morceau.encode('utf-8')
+        else:
+            yield from lots_vers_arrow(lots, colonnes, format_sortie)
 
-    return {"response": get_ai_response(user_msg, context=context_str)}
+    mimetype, extension = FORMATS_EXPORT[format_sortie]
+    response = Response(stream_with_context(generer()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=audits_evolucheck.{extension}'
+    return response
 
 # --- EXPORT PDF (DESIGN MINIMALISTE) ---
 
 @app.route('/export_pdf')
 def export_pdf():
-    if 'last_audit' not in session: return redirect(url_for('audit'))
-    data = session['last_audit']
-    
+    resultat = audit_en_session()
+    if not resultat: return redirect(url_for('audit'))
+
+    # Le navigateur possède déjà ce rapport : réponse 304 immédiate, hors contrôle d'admission
+    cle = cle_rapport(session['last_audit'])
+    if cle in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(cle)
+        return response
+    return envoyer_rapport_pdf(resultat, cle)
+
+@admission('export_pdf')
+def envoyer_rapport_pdf(resultat, cle):
+    """Rapport PDF (cache ou génération), soumis au contrôle d'admission."""
+    contenu = cache_rapports.get(cle)
+    if contenu is None:
+        contenu = construire_rapport_pdf(resultat.vers_dict())
+        cache_rapports.set(cle, contenu)
+
+    response = make_response(contenu)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = 'attachment; filename=rapport_audit_evolucheck_final.pdf'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(cle)
+    return response
+
+def construire_rapport_pdf(data):
+    """Construit le rapport PDF complet et retourne son contenu binaire."""
     # Chemins des ressources (Logo)
     logo_path = os.path.join(app.root_path, 'static', 'img', 'logo.png')
     
@@ -850,7 +2218,7 @@ def export_pdf():
     
     # Données KPI
     kpis = [
-        ("Dette Technique", data.get('dette', '-').capitalize(), "Maîtrisée", "Impact limité"),
+        ("Dette Technique", (data.get('dette') or '-').capitalize(), "Maîtrisée", "Impact limité"),
         ("Temps Déploiement", f"{data.get('temps', '-')} j", "Optimisé" if data.get('temps',0) <= 15 else "Lent", "Processus CI/CD"),
         ("Budget R&D", f"{data.get('rd', '-')} %", "Correct", "Investissement continu"),
         ("PUE (Efficience)", str(data.get('pue', '-')), "Critique" if data.get('pue', 0) > 1.5 else "Optimal", "Green IT"),
@@ -941,14 +2309,96 @@ def export_pdf():
     pdf.line(x_line, pdf.get_y(), x_line + 50, pdf.get_y())
     
     # Output
-    response = make_response(pdf.output(dest='S').encode('latin-1'))
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'attachment; filename=rapport_audit_evolucheck_final.pdf'
-    return response
+    return pdf.output(dest='S').encode('latin-1')
+
+# --- COMMANDES D'ADMINISTRATION (flask <commande>) ---
+
+@app.cli.command('rescorer')
+@click.option('--taille-lot', default=5000, show_default=True, help="Nombre d'audits traités par lot.")
+@click.option('--simulation', is_flag=True, help="Calcule et affiche les changements sans écrire en base.")
+def rescorer(taille_lot, simulation):
+    """Recalcule les scores des audits stockés selon les règles courantes (REGLES_VERSION)."""
+    colonnes_resultat = ['score_adaptabilite', 'score_innovation', 'score_durabilite', 'score_global', 'diagnostic_type', 'recommandations']
+    colonnes_kpi = list(COLONNES_KPI.values())
+    requete = db.select(Audit.id, *[getattr(Audit, c) for c in colonnes_resultat + colonnes_kpi])
+
+    dernier_id = 0
+    analyses = modifies = ignores = versionnes = 0
+    debut = time.perf_counter()
+
+    while True:
+        # Pagination par clé (id) : coût constant par lot quelle que soit la taille de la table
+        lignes = db.session.execute(requete.where(Audit.id > dernier_id).order_by(Audit.id).limit(taille_lot)).all()
+        if not lignes:
+            break
+        dernier_id = lignes[-1].id
+        stockes = pd.DataFrame(lignes, columns=['id'] + colonnes_resultat + colonnes_kpi).set_index('id')
+
+        # Audits antérieurs au stockage des KPIs bruts : impossibles à recalculer
+        complets = stockes[colonnes_kpi].notna().all(axis=1)
+        ignores += int((~complets).sum())
+        stockes = stockes[complets]
+        if stockes.empty:
+            continue
+
+        nouveaux = calculer_scores_vectorises(stockes[colonnes_kpi].rename(columns={v: k for k, v in COLONNES_KPI.items()}))
+        analyses += len(nouveaux)
+
+        # Seules les lignes dont le résultat change réellement sont réécrites
+        change = (~np.isclose(nouveaux['score_global'], stockes['score_global'].astype(float))
+                  | (nouveaux[colonnes_resultat[:3]] != stockes[colonnes_resultat[:3]]).any(axis=1)
+                  | (nouveaux['diagnostic_type'] != stockes['diagnostic_type'])
+                  | (nouveaux['recommandations'] != stockes['recommandations']))
+        a_modifier = nouveaux[change]
+        if a_modifier.empty:
+            continue
+        modifies += len(a_modifier)
+
+        if not simulation:
+            a_modifier = a_modifier.assign(regles_version=REGLES_VERSION)
+            db.session.execute(db.update(Audit), a_modifier.reset_index().to_dict('records'))
+            db.session.commit()
+
+    # Tous les audits vérifiés (modifiés ou non) ont été produits par les règles courantes : une seule requête
+    if not simulation:
+        kpis_complets = [getattr(Audit, c).isnot(None) for c in colonnes_kpi]
+        versionnes = db.session.execute(
+            db.update(Audit)
+            .where(Audit.id <= dernier_id, *kpis_complets,
+                   db.or_(Audit.regles_version.is_(None), Audit.regles_version != REGLES_VERSION))
+            .values(regles_version=REGLES_VERSION)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+
+    duree = time.perf_counter() - debut
+    debit = analyses / duree if duree > 0 else 0
+    click.echo(f"{analyses} audits analysés, {modifies} modifiés, {versionnes} passés en version {REGLES_VERSION}, "
+               f"{ignores} ignorés (KPIs bruts absents) "
+               f"en {duree:.2f} s ({debit:,.0f} audits/s){' [simulation]' if simulation else ''}.")
+
+def migrer_schema():
+    """
+    Ajoute les colonnes et index manquants aux tables existantes
+    (db.create_all() ne modifie pas une table déjà créée).
+    """
+    inspecteur = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspecteur.has_table(table.name):
+            continue
+        existantes = {c['name'] for c in inspecteur.get_columns(table.name)}
+        for colonne in table.columns:
+            if colonne.name not in existantes:
+                type_sql = colonne.type.compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {colonne.name} {type_sql}"))
+        db.session.commit()
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
 
 # Initialisation DB au lancement
 with app.app_context():
     db.create_all()
+    migrer_schema()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,226 @@
+"""
+Test de charge local d'EvoluCheck.
+
+Chaque utilisateur virtuel rejoue le parcours complet : connexion (/auth), audit (/audit),
+tableau de bord (/dashboard), rapport PDF (/export_pdf), chat (/api/chat) et import CSV
+(/import_csv). L'application tourne sous gunicorn avec des serveurs factices pour OpenAI
+et n8n ; le script affiche débit et latences p50/p95/p99 par route, à concurrence croissante.
+
+Exemples :
+    python bench_charge.py --workers 4 --concurrence 1,4,8,16,32 --duree 20
+    python bench_charge.py --url http://127.0.0.1:8000 --concurrence 8   # application déjà lancée
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROUTES = ['/auth', '/audit', '/dashboard', '/export_pdf', '/api/chat', '/import_csv']
+
+# --- SERVEURS FACTICES (OPENAI & N8N) ---
+
+def serveur_factice(reponse, latence):
+    """Serveur HTTP local qui répond `reponse` (JSON) à tout POST après `latence` secondes."""
+    corps = json.dumps(reponse).encode()
+
+    class Gestionnaire(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latence)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+
+        def log_message(self, *args):
+            pass
+
+    serveur = ThreadingHTTPServer(('127.0.0.1', 0), Gestionnaire)
+    serveur.daemon_threads = True
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    return serveur
+
+def reponse_openai():
+    return {
+        "id": "chatcmpl-factice", "object": "chat.completion", "created": int(time.time()), "model": "gpt-3.5-turbo",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "Réponse factice d'EvoluBot : priorisez la modularité de l'architecture."}}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+    }
+
+# --- LANCEMENT DE L'APPLICATION SOUS GUNICORN ---
+
+def port_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def lancer_application(args, url_openai, url_n8n, dossier):
+    """Démarre gunicorn sur une base et des caches temporaires ; renvoie (processus, url)."""
+    port = port_libre()
+    env = dict(os.environ,
+               OPENAI_API_KEY='sk-factice',
+               OPENAI_BASE_URL=url_openai,
+               N8N_WEBHOOK_URL=url_n8n,
+               DATABASE_URL=f"sqlite:///{os.path.join(dossier, 'bench.db')}",
+               PDF_CACHE_DIR=os.path.join(dossier, 'cache_pdf'),
+               ADMISSION_DIR=os.path.join(dossier, 'admission'),
+               ADMISSION_ACTIVE='1' if args.admission else '0')
+    commande = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                '--bind', f'127.0.0.1:{port}', '--timeout', '120', 'app:app']
+    processus = subprocess.Popen(commande, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 stdout=subprocess.DEVNULL, stderr=None if args.verbeux else subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        if processus.poll() is not None:
+            sys.exit(f"gunicorn s'est arrêté (code {processus.returncode}) ; relancez avec --verbeux")
+        try:
+            requests.get(url + '/', timeout=5)
+            return processus, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    processus.terminate()
+    sys.exit("gunicorn ne répond pas")
+
+# --- PARCOURS UTILISATEUR ---
+
+def formulaire_audit():
+    return {
+        'dep_fournisseur': random.randint(1, 10), 'temps_deploy': random.randint(1, 40),
+        'arch_modulaire': random.choice(['oui', 'non']), 'budget_rd': round(random.uniform(0, 20), 1),
+        'nb_poc': random.randint(0, 15), 'pue': round(random.uniform(1.0, 2.5), 2),
+        'recyclage': random.choice(['oui', 'non']), 'dette_technique': random.choice(['faible', 'moyenne', 'critique']),
+        'taux_transformation_poc': random.randint(0, 100), 'part_energie_verte': random.randint(0, 100),
+    }
+
+def csv_import(lignes=20):
+    """Petit CSV aléatoire : évite que la déduplication par empreinte ne court-circuite l'import."""
+    entete = 'dep_fournisseur,temps_deploy,arch_modulaire,budget_rd,nb_poc,pue,recyclage,dette_technique,taux_transformation,energie_verte'
+    corps = []
+    for _ in range(lignes):
+        f = formulaire_audit()
+        corps.append(f"{f['dep_fournisseur']},{f['temps_deploy']},{f['arch_modulaire']},{f['budget_rd']},{f['nb_poc']},"
+                     f"{f['pue']},{f['recyclage']},{f['dette_technique']},{f['taux_transformation_poc']},{f['part_energie_verte']}")
+    return (entete + '\n' + '\n'.join(corps) + '\n').encode()
+
+def parcours(url, numero, fin, mesures):
+    """Boucle d'un utilisateur virtuel jusqu'à `fin` ; ajoute (route, durée, statut) à `mesures`."""
+    s = requests.Session()
+    email = f'charge{numero}@evolucheck.test'
+
+    def appel(route, methode, **kwargs):
+        debut = time.perf_counter()
+        try:
+            statut = s.request(methode, url + route, allow_redirects=False, timeout=120, **kwargs).status_code
+        except requests.RequestException:
+            statut = 0
+        mesures.append((route, time.perf_counter() - debut, statut))
+
+    while time.monotonic() < fin:
+        appel('/auth', 'POST', data={'action': 'login', 'email': email})
+        appel('/audit', 'POST', data=formulaire_audit())
+        appel('/dashboard', 'GET')
+        appel('/export_pdf', 'GET')
+        appel('/api/chat', 'POST', json={'message': 'Comment améliorer mon score de durabilité ?'})
+        appel('/import_csv', 'POST', files={'file': ('charge.csv', csv_import(), 'text/csv')},
+              headers={'Accept': 'application/json'})
+
+def mesurer_palier(url, concurrence, duree):
+    mesures = []
+    fin = time.monotonic() + duree
+    utilisateurs = [threading.Thread(target=parcours, args=(url, i, fin, mesures)) for i in range(concurrence)]
+    debut = time.perf_counter()
+    for u in utilisateurs:
+        u.start()
+    for u in utilisateurs:
+        u.join()
+    return mesures, time.perf_counter() - debut
+
+# --- RAPPORT ---
+
+def percentile(valeurs, p):
+    """Percentile par rang le plus proche (valeurs triées)."""
+    return valeurs[min(len(valeurs) - 1, max(0, round(p / 100 * len(valeurs)) - 1))]
+
+def synthese(mesures, duree):
+    par_route = defaultdict(list)
+    for route, latence, statut in mesures:
+        par_route[route].append((latence, statut))
+    lignes = {}
+    for route in ROUTES + ['TOTAL']:
+        donnees = [m for r in ROUTES for m in par_route[r]] if route == 'TOTAL' else par_route[route]
+        if not donnees:
+            continue
+        latences = sorted(l for l, _ in donnees)
+        statuts = [st for _, st in donnees]
+        lignes[route] = {
+            'requetes': len(donnees), 'debit': len(donnees) / duree,
+            'p50_ms': percentile(latences, 50) * 1000, 'p95_ms': percentile(latences, 95) * 1000,
+            'p99_ms': percentile(latences, 99) * 1000,
+            'rejets_429': statuts.count(429), 'rejets_503': statuts.count(503),
+            'erreurs': sum(1 for st in statuts if st == 0 or (st >= 400 and st not in (429, 503))),
+        }
+    return lignes
+
+def afficher(concurrence, lignes):
+    print(f"\n=== Concurrence : {concurrence} utilisateurs ===")
+    print(f"{'route':<12}{'req':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'429':>6}{'503':>6}{'err':>6}")
+    for route, l in lignes.items():
+        print(f"{route:<12}{l['requetes']:>7}{l['debit']:>9.1f}{l['p50_ms']:>9.0f}{l['p95_ms']:>9.0f}{l['p99_ms']:>9.0f}"
+              f"{l['rejets_429']:>6}{l['rejets_503']:>6}{l['erreurs']:>6}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge local des parcours EvoluCheck.")
+    parser.add_argument('--url', help="Application déjà lancée (sinon gunicorn est démarré avec les serveurs factices)")
+    parser.add_argument('--workers', type=int, default=2, help="Workers gunicorn")
+    parser.add_argument('--threads', type=int, default=1, help="Threads par worker gunicorn")
+    parser.add_argument('--concurrence', default='1,2,4,8,16', help="Paliers d'utilisateurs simultanés")
+    parser.add_argument('--duree', type=float, default=15, help="Durée de chaque palier (s)")
+    parser.add_argument('--latence-ia', type=float, default=0.3, help="Latence simulée d'OpenAI (s)")
+    parser.add_argument('--latence-n8n', type=float, default=0.05, help="Latence simulée de n8n (s)")
+    parser.add_argument('--admission', action=argparse.BooleanOptionalAction, default=False,
+                        help="Conserver le contrôle d'admission (429/503) pendant le test")
+    parser.add_argument('--json', help="Écrit aussi les résultats dans ce fichier JSON")
+    parser.add_argument('--verbeux', action='store_true', help="Affiche les journaux de gunicorn")
+    args = parser.parse_args()
+
+    processus = None
+    with tempfile.TemporaryDirectory(prefix='evolucheck-charge-') as dossier:
+        if args.url:
+            url = args.url.rstrip('/')
+        else:
+            openai_factice = serveur_factice(reponse_openai(), args.latence_ia)
+            n8n_factice = serveur_factice({"ok": True}, args.latence_n8n)
+            processus, url = lancer_application(
+                args, f'http://127.0.0.1:{openai_factice.server_port}/v1',
+                f'http://127.0.0.1:{n8n_factice.server_port}/webhook/audit-alert', dossier)
+            print(f"gunicorn : {args.workers} worker(s) x {args.threads} thread(s) sur {url}")
+
+        resultats = {}
+        try:
+            for concurrence in [int(c) for c in args.concurrence.split(',')]:
+                mesures, duree = mesurer_palier(url, concurrence, args.duree)
+                resultats[concurrence] = synthese(mesures, duree)
+                afficher(concurrence, resultats[concurrence])
+        finally:
+            if processus:
+                processus.terminate()
+                processus.wait()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'workers': args.workers, 'threads': args.threads, 'paliers': resultats}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
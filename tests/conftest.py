@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Base, caches et webhooks isolés : à définir avant l'import de l'application
+_DOSSIER = tempfile.mkdtemp(prefix='evolucheck-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_DOSSIER, 'tests.db')}"
+os.environ['PDF_CACHE_DIR'] = os.path.join(_DOSSIER, 'cache_pdf')
+os.environ['ADMISSION_DIR'] = os.path.join(_DOSSIER, 'admission')
+os.environ['ADMISSION_ACTIVE'] = '0'
+os.environ['PROXY_HOPS'] = '0' # Client de test exposé directement : X-Forwarded-For ignoré
+os.environ['OPENAI_API_KEY'] = ''
+os.environ['N8N_WEBHOOK_URL'] = 'http://127.0.0.1:9/webhook'
+os.environ['N8N_TIMEOUT'] = '0.1'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as evolucheck  # noqa: E402
+
+
+@pytest.fixture
+def application():
+    return evolucheck
+
+
+@pytest.fixture
+def client():
+    client = evolucheck.app.test_client()
+    client.post('/auth', data={'action': 'login', 'email': 'testeur@evolucheck.test'})
+    return client
@@ -0,0 +1,43 @@
+import io
+
+from test_audit_result import FORMULAIRE
+
+
+def test_revalidation_pdf_hors_limite_de_debit(application, client, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'ADMISSION_ACTIVE', True)
+    client.post('/auth', data={'action': 'login', 'email': 'revalidation@evolucheck.test'})
+    client.post('/audit', data=FORMULAIRE)
+
+    premiere = client.get('/export_pdf')
+    assert premiere.status_code == 200
+    rafale = application.app.config['LIMITES_ADMISSION']['export_pdf']['rafale']
+    for _ in range(rafale * 2):
+        assert client.get('/export_pdf', headers={'If-None-Match': premiere.headers['ETag']}).status_code == 304
+    assert client.get('/export_pdf').status_code == 200
+
+
+def importer(application, ip, email=None):
+    client = application.app.test_client()
+    if email:
+        client.post('/auth', data={'action': 'login', 'email': email}, environ_base={'REMOTE_ADDR': ip})
+    return client.post(
+        '/import_csv', data={'file': (io.BytesIO(b'a,b\n1,2\n'), 'x.csv')},
+        headers={'Accept': 'application/json', 'X-Forwarded-For': '198.51.100.99'},
+        environ_base={'REMOTE_ADDR': ip}).status_code
+
+
+def test_clients_anonymes_distingues_par_ip(application, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'ADMISSION_ACTIVE', True)
+    rafale = application.app.config['LIMITES_ADMISSION']['import_csv']['rafale']
+
+    # X-Forwarded-For (sans proxy de confiance) ne permet pas de changer d'identité
+    assert [importer(application, '203.0.113.1') for _ in range(rafale + 1)][-1] == 429
+    assert importer(application, '203.0.113.2') != 429
+
+
+def test_reconnexion_sous_un_autre_email_ne_reinitialise_pas_la_limite(application, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'ADMISSION_ACTIVE', True)
+    rafale = application.app.config['LIMITES_ADMISSION']['import_csv']['rafale']
+
+    statuts = [importer(application, '203.0.113.3', f'alias{i}@evolucheck.test') for i in range(rafale + 1)]
+    assert statuts[-1] == 429
@@ -0,0 +1,42 @@
+import pytest
+
+from test_scoring import kpis_aleatoires
+
+FORMULAIRE = {
+    'dep_fournisseur': '7', 'temps_deploy': '5', 'arch_modulaire': 'oui', 'budget_rd': '6', 'nb_poc': '3',
+    'pue': '1.3', 'recyclage': 'oui', 'dette_technique': 'critique', 'taux_transformation_poc': '40', 'part_energie_verte': '70',
+}
+
+
+def test_aller_retour_binaire_sans_perte(application):
+    for inputs in kpis_aleatoires(application, 500, graine=2).to_dict('records'):
+        inputs = {cle: valeur.item() if hasattr(valeur, 'item') else valeur for cle, valeur in inputs.items()}
+        resultat = application.AuditResult.calculer(inputs, 'Amine', 'amine@evolucheck.test')
+        relu = application.AuditResult.depuis_binaire(resultat.vers_binaire())
+        assert relu.vers_dict() == resultat.vers_dict()
+        assert relu.inputs() == inputs
+
+
+def test_modalite_inconnue_non_serialisable(application):
+    inputs = kpis_aleatoires(application, 1).to_dict('records')[0]
+    resultat = application.AuditResult.calculer({**inputs, 'dette': 'inconnue'}, 'Amine', None)
+    with pytest.raises(ValueError):
+        resultat.vers_binaire()
+
+
+def test_formulaire_audit_valide(application, client):
+    reponse = client.post('/audit', data=FORMULAIRE)
+    assert reponse.status_code == 302 and reponse.location.endswith('/dashboard')
+    with client.session_transaction() as s:
+        audit = application.AuditResult.depuis_binaire(s['last_audit'])
+    assert audit.temps == 5 and audit.dette == 'critique'
+
+
+@pytest.mark.parametrize('champ, valeur', [('temps_deploy', '3000000000'), ('dette_technique', 'elevee'), ('pue', 'abc'),
+                                            ('taux_transformation_poc', '150'), ('part_energie_verte', '-1')])
+def test_formulaire_audit_hors_schema_rejete(client, champ, valeur):
+    reponse = client.post('/audit', data={**FORMULAIRE, champ: valeur})
+    assert reponse.status_code == 302 and reponse.location.endswith('/audit')
+    with client.session_transaction() as s:
+        assert 'last_audit' not in s
+        assert any(champ in message for _, message in s['_flashes'])
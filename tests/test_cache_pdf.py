@@ -0,0 +1,68 @@
+import os
+import time
+from datetime import date
+
+from test_audit_result import FORMULAIRE
+
+
+def cache(application, tmp_path, max_memoire=1000, max_disque=10_000):
+    return application.CacheRapports(str(tmp_path), max_memoire, max_disque)
+
+
+def test_memoire_bornee_en_octets(application, tmp_path):
+    rapports = cache(application, tmp_path, max_memoire=250)
+    for cle in 'abc':
+        rapports.set(cle, cle.encode() * 100)
+    assert list(rapports._memoire) == ['b', 'c']
+    assert rapports._taille_memoire == 200
+
+
+def test_lecture_disque_apres_perte_de_la_memoire(application, tmp_path):
+    rapports = cache(application, tmp_path)
+    rapports.set('cle', b'%PDF-contenu')
+    # Autre worker (ou redémarrage) : mémoire vide, même répertoire
+    autre_worker = cache(application, tmp_path)
+    assert autre_worker.get('cle') == b'%PDF-contenu'
+    assert 'cle' in autre_worker._memoire
+
+
+def test_disque_borne_evince_les_plus_anciens(application, tmp_path):
+    rapports = cache(application, tmp_path, max_memoire=0, max_disque=250)
+    for i, cle in enumerate('abc'):
+        rapports.set(cle, b'x' * 100)
+        os.utime(tmp_path / f"{cle}.pdf", (i, i))
+    rapports._evincer_disque()
+    assert sorted(os.listdir(tmp_path)) == ['b.pdf', 'c.pdf']
+
+
+def test_temporaires_abandonnes_evinces(application, tmp_path):
+    abandonne, en_cours = tmp_path / 'abandonne.tmp', tmp_path / 'en_cours.tmp'
+    abandonne.write_bytes(b'partiel')
+    en_cours.write_bytes(b'partiel')
+    ancien = time.time() - application.CacheRapports.DELAI_TEMPORAIRES - 1
+    os.utime(abandonne, (ancien, ancien))
+
+    cache(application, tmp_path).set('cle', b'%PDF')
+    assert sorted(os.listdir(tmp_path)) == ['cle.pdf', 'en_cours.tmp']
+
+
+def test_cle_change_avec_le_jour(application, monkeypatch):
+    class Demain(date):
+        @classmethod
+        def today(cls):
+            return date.fromordinal(date.today().toordinal() + 1)
+
+    aujourd_hui = application.cle_rapport(b'audit')
+    assert application.cle_rapport(b'audit') == aujourd_hui
+    monkeypatch.setattr(application, 'date', Demain)
+    assert application.cle_rapport(b'audit') != aujourd_hui
+
+
+def test_meme_etag_au_second_telechargement(client):
+    client.post('/audit', data=FORMULAIRE)
+    premier = client.get('/export_pdf')
+    second = client.get('/export_pdf')
+    assert premier.status_code == second.status_code == 200
+    assert premier.headers['ETag'] == second.headers['ETag']
+    assert premier.data == second.data and premier.data.startswith(b'%PDF')
+    assert client.get('/export_pdf', headers={'If-None-Match': premier.headers['ETag']}).status_code == 304
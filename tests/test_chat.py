@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+
+class ClientFactice:
+    """Client OpenAI factice : compte les appels de chat et de résumé."""
+    def __init__(self, reponse):
+        self.reponse = reponse
+        self.appels = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        resume = messages[0]['content'].startswith("Tu résumes")
+        self.appels.append('resume' if resume else 'chat')
+        texte = 'Résumé factice.' if resume else self.reponse
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=texte))])
+
+
+def test_resume_amorti_sur_plusieurs_messages(application, client, monkeypatch):
+    factice = ClientFactice("Voici une recommandation détaillée sur la modularité de votre architecture. " * 3)
+    monkeypatch.setattr(application, 'client', factice)
+
+    for i in range(40):
+        assert client.post('/api/chat', json={'message': f"Question {i} : comment améliorer ma durabilité ?"}).status_code == 200
+
+    assert factice.appels.count('chat') == 40
+    assert factice.appels.count('resume') <= 40 // 5
+
+
+def test_reponse_commencant_par_erreur_memorisee(application, client, monkeypatch):
+    monkeypatch.setattr(application, 'client', ClientFactice("Erreur fréquente : confondre PUE et DCiE."))
+    client.post('/api/chat', json={'message': "Quelle erreur éviter ?"})
+
+    with client.session_transaction() as s:
+        id_conversation = s['conversation_id']
+    with application.app.app_context():
+        conversation = application.db.session.get(application.ConversationChat, id_conversation)
+        assert "Erreur fréquente" in conversation.tours
+
+
+def test_echec_ia_non_memorise(application, client):
+    reponse = client.post('/api/chat', json={'message': "Bonjour"}).get_json()
+    assert reponse['response'].startswith("Erreur")
+
+    with client.session_transaction() as s:
+        id_conversation = s['conversation_id']
+    with application.app.app_context():
+        assert application.db.session.get(application.ConversationChat, id_conversation).tours == '[]'
@@ -0,0 +1,45 @@
+import csv
+import io
+
+
+def ajouter_audits(application, *emails):
+    with application.app.app_context():
+        application.db.session.add_all([application.Audit(user_email=email, score_global=50.0) for email in emails])
+        application.db.session.commit()
+
+
+def emails_exportes(reponse):
+    assert reponse.status_code == 200
+    return {ligne['user_email'] for ligne in csv.DictReader(io.StringIO(reponse.get_data(as_text=True)))}
+
+
+def test_export_limite_aux_audits_de_l_utilisateur(application, client):
+    ajouter_audits(application, 'testeur@evolucheck.test', 'autre@evolucheck.test')
+    assert emails_exportes(client.get('/api/audits/export')) == {'testeur@evolucheck.test'}
+    assert client.get('/api/audits/export?user=autre@evolucheck.test').status_code == 403
+
+
+def test_export_global_reserve_aux_emails_verifies_autorises(application, client, monkeypatch):
+    ajouter_audits(application, 'testeur@evolucheck.test', 'autre@evolucheck.test')
+    monkeypatch.setitem(application.app.config, 'ACCES_GLOBAL', {'testeur@evolucheck.test'})
+    # Email déclaré via /auth : pas d'accès global
+    assert emails_exportes(client.get('/api/audits/export')) == {'testeur@evolucheck.test'}
+
+    with client.session_transaction() as s:
+        s['email_verifie'] = True
+    assert {'testeur@evolucheck.test', 'autre@evolucheck.test'} <= emails_exportes(client.get('/api/audits/export'))
+    assert emails_exportes(client.get('/api/audits/export?user=autre@evolucheck.test')) == {'autre@evolucheck.test'}
+
+
+def test_creneau_occupe_pendant_tout_le_flux(application, client, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'ADMISSION_ACTIVE', True)
+    monkeypatch.setitem(application.app.config['LIMITES_ADMISSION'], 'export_audits',
+                        {'concurrence': 1, 'debit': 100, 'rafale': 100})
+    ajouter_audits(application, 'testeur@evolucheck.test')
+
+    en_cours = client.get('/api/audits/export', buffered=False)
+    assert en_cours.status_code == 200
+    assert client.get('/api/audits/export').status_code == 503
+    en_cours.get_data()
+    en_cours.close()
+    assert client.get('/api/audits/export').status_code == 200
@@ -0,0 +1,77 @@
+import threading
+
+
+def ajouter_audit(application, email, scores=(2.0, 3.0, 4.0)):
+    with application.app.app_context():
+        audit = application.Audit(
+            user_email=email, score_adaptabilite=scores[0], score_innovation=scores[1], score_durabilite=scores[2],
+            score_global=round(sum(scores) / 15 * 100, 1), diagnostic_type='FRAP',
+            dep_fournisseur=40.0, temps_deploy=20, arch_modulaire='non', budget_rd=1.0, nb_poc=0, pue=2.0,
+            recyclage='non', dette_technique='moyenne', taux_transformation_poc=0.0, part_energie_verte=0.0)
+        application.db.session.add(audit)
+        application.db.session.commit()
+        return audit.id
+
+
+def test_graphiques_limites_aux_audits_de_l_utilisateur(application, client):
+    mien = ajouter_audit(application, 'testeur@evolucheck.test')
+    autre = ajouter_audit(application, 'autre@evolucheck.test')
+
+    resultat = client.get(f'/api/graphiques?ids={mien},{autre}&images=0').get_json()
+    assert list(resultat['graphiques']) == [str(mien)]
+    assert resultat['absents'] == [autre]
+
+
+def test_cache_par_contenu_suit_le_recalcul_des_scores(application, client):
+    premier = ajouter_audit(application, 'testeur@evolucheck.test', scores=(1.0, 1.0, 1.0))
+    second = ajouter_audit(application, 'testeur@evolucheck.test', scores=(1.0, 1.0, 1.0))
+    graphiques = client.get(f'/api/graphiques?ids={premier},{second}').get_json()['graphiques']
+    # Contenu identique : un seul rendu, partagé
+    assert graphiques[str(premier)]['images'] == graphiques[str(second)]['images']
+
+    # Scores réécrits (p. ex. par flask rescorer) sans changement de regles_version
+    with application.app.app_context():
+        application.db.session.get(application.Audit, premier).score_durabilite = 5.0
+        application.db.session.commit()
+    apres = client.get(f'/api/graphiques?ids={premier}').get_json()['graphiques'][str(premier)]
+    assert apres['scores_radar'] == [1.0, 1.0, 5.0]
+    assert apres['images']['radar'] != graphiques[str(premier)]['images']['radar']
+
+
+def test_graphiques_d_un_audit_sans_kpis_bruts(application, client):
+    with application.app.app_context():
+        audit = application.Audit(user_email='testeur@evolucheck.test', score_adaptabilite=3.0, score_innovation=3.0,
+                                  score_durabilite=3.0, score_global=60.0, diagnostic_type='FRAP')
+        application.db.session.add(audit)
+        application.db.session.commit()
+        id_audit = audit.id
+    graphique = client.get(f'/api/graphiques?ids={id_audit}').get_json()['graphiques'][str(id_audit)]
+    assert graphique['risques'] == [] and graphique['images']['farmer']
+
+
+def test_corps_non_objet_rejete(client):
+    assert client.post('/api/graphiques', json=[1, 2]).status_code == 400
+
+
+def test_un_seul_rendu_par_contenu_dans_une_requete(application, client, monkeypatch):
+    ids = [ajouter_audit(application, 'testeur@evolucheck.test', scores=(1.5, 2.5, 3.5)) for _ in range(3)]
+    rendus = []
+    rendre = application.rendre_graphiques
+    monkeypatch.setattr(application, 'rendre_graphiques', lambda *args: rendus.append(args) or rendre(*args))
+    monkeypatch.setitem(application.app.config, 'GRAPHIQUES_PROCESSUS', 1)
+
+    graphiques = client.get(f"/api/graphiques?ids={','.join(map(str, ids))}").get_json()['graphiques']
+    assert len(rendus) == 1
+    assert all(graphiques[str(i)]['images'] == graphiques[str(ids[0])]['images'] for i in ids)
+
+
+def test_pas_de_pool_par_fork_dans_un_worker_multi_thread(application, monkeypatch):
+    monkeypatch.setattr(application, '_pool_graphiques', None)
+    arret = threading.Event()
+    autre_thread = threading.Thread(target=arret.wait)
+    autre_thread.start()
+    try:
+        assert application.pool_graphiques() is None
+    finally:
+        arret.set()
+        autre_thread.join()
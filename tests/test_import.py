@@ -0,0 +1,56 @@
+import io
+
+ENTETE = 'dep_fournisseur,temps_deploy,arch_modulaire,budget_rd,nb_poc,pue,recyclage,dette_technique,taux_transformation,energie_verte'
+LIGNE = '5,2,oui,12.5,8,1.5,non,faible,60,20'
+
+
+def importer(client, contenu):
+    return client.post('/import_csv', data={'file': (io.BytesIO(contenu.encode()), 'import.csv')},
+                       headers={'Accept': 'application/json'})
+
+
+def lire(application, contenu):
+    return application.lire_csv_kpis(io.StringIO(contenu))
+
+
+def test_empreinte_stable_quel_que_soit_le_format_des_nombres(application):
+    df_a, _ = lire(application, f"{ENTETE}\n5,2,oui,12.5,8,1.5,non,faible,60,20\n")
+    df_b, _ = lire(application, f"{ENTETE}\n5.0,2,OUI,12.50,8,1.50,non,Faible,60.0,20\n")
+    assert application.empreintes_lignes(df_a, 'a@b.c') == application.empreintes_lignes(df_b, 'a@b.c')
+
+
+def test_empreinte_depend_de_l_utilisateur_et_du_site(application):
+    df, _ = lire(application, f"{ENTETE},site\n{LIGNE},Lyon\n{LIGNE},Nantes\n")
+    lyon, nantes = application.empreintes_lignes(df, 'a@b.c')
+    assert lyon != nantes
+    assert application.empreintes_lignes(df, 'autre@b.c')[0] != lyon
+
+
+def test_reimport_idempotent_et_doublons_signales(client):
+    contenu = f"{ENTETE}\n{LIGNE}\n{LIGNE}\n1,3,non,1,0,2.0,oui,moyenne,10,10\n"
+    premier = importer(client, contenu).get_json()
+    assert premier['lignes_nouvelles'] == 2
+    assert premier['lignes_dupliquees'] == 1
+
+    second = importer(client, contenu).get_json()
+    assert second['lignes_nouvelles'] == 0
+    assert second['lignes_deja_importees'] == 2
+
+
+def test_sites_aux_kpis_identiques_importes_separement(client):
+    ligne = '7,9,non,3,2,1.8,oui,critique,30,70'
+    resultat = importer(client, f"{ENTETE},site\n{ligne},Lille\n{ligne},Brest\n").get_json()
+    assert resultat['lignes_nouvelles'] == 2
+    assert resultat['lignes_dupliquees'] == 0
+
+
+def test_entiers_hors_bornes_rejetes(application):
+    df, rapport = lire(application, f"{ENTETE}\n5,1e20,oui,12.5,8,1.5,non,faible,60,20\n5,2,oui,12.5,3000000000,1.5,non,faible,60,20\n")
+    assert df.empty
+    assert [e['colonne'] for rejet in rapport['rejets'] for e in rejet['erreurs']] == ['temps_deploy', 'nb_poc']
+
+
+def test_en_tetes_non_reconnus_signales(client):
+    reponse = importer(client, "a,b,c\n1,2,3\n")
+    assert reponse.status_code == 400
+    assert 'dep_fournisseur' in reponse.get_json()['message']
@@ -0,0 +1,42 @@
+import io
+
+
+def test_portefeuille_exclut_les_audits_sans_kpis_bruts(application, client):
+    email = 'portefeuille@evolucheck.test'
+    client.post('/auth', data={'action': 'login', 'email': email})
+    with application.app.app_context():
+        application.db.session.add_all([
+            # Audit antérieur au stockage des KPIs bruts
+            application.Audit(user_email=email, score_global=50.0),
+            # Dépendance fournisseur > 25 % : risque de lock-in
+            application.Audit(user_email=email, score_global=50.0, dep_fournisseur=40.0, temps_deploy=5, pue=1.2, budget_rd=10.0),
+            # Audit d'un autre utilisateur : hors du portefeuille
+            application.Audit(user_email='autre@evolucheck.test', score_global=50.0,
+                              dep_fournisseur=40.0, temps_deploy=5, pue=1.2, budget_rd=10.0),
+        ])
+        application.db.session.commit()
+
+    for url in ('/api/risques/portefeuille', f'/api/risques/portefeuille?user={email}'):
+        resultat = client.get(url).get_json()
+        assert resultat['sites'] == 1
+        assert resultat['sites_a_risque'] == 1
+        assert resultat['sites_non_evaluables'] == 1
+
+
+def test_portefeuille_d_un_autre_utilisateur_refuse(client):
+    reponse = client.get('/api/risques/portefeuille?user=autre@evolucheck.test')
+    assert reponse.status_code == 403
+    assert 'erreur' in reponse.get_json()
+
+
+def test_portefeuille_csv_soumis_a_l_admission(application, client, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'ADMISSION_ACTIVE', True)
+    client.post('/auth', data={'action': 'login', 'email': 'portefeuille-csv@evolucheck.test'})
+    rafale = application.app.config['LIMITES_ADMISSION']['portefeuille']['rafale']
+
+    def envoyer():
+        return client.post('/api/risques/portefeuille',
+                           data={'file': (io.BytesIO(b'dep_fournisseur,temps_deploy\n40,5\n'), 'sites.csv')}).status_code
+
+    assert [envoyer() for _ in range(rafale)] == [200] * rafale
+    assert envoyer() == 429
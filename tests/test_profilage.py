@@ -0,0 +1,26 @@
+import os
+
+from flask import g
+
+
+def test_en_tete_de_profilage_exige_le_secret(application, tmp_path, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'PROFILAGE_TAUX', 0.0)
+    monkeypatch.setitem(application.app.config, 'PROFILAGE_DIR', str(tmp_path))
+    for secret, en_tete, attendu in [('', '1', False), ('s3cret', '1', False), ('s3cret', 's3cret', True)]:
+        monkeypatch.setitem(application.app.config, 'PROFILAGE_SECRET', secret)
+        with application.app.test_request_context('/', headers={'X-Profilage': en_tete}):
+            application._demarrer_profilage()
+            assert ('profil' in g) is attendu
+            application._terminer_profilage()
+
+
+def test_seuls_les_profils_recents_sont_conserves(application, tmp_path, monkeypatch):
+    monkeypatch.setitem(application.app.config, 'PROFILAGE_DIR', str(tmp_path))
+    for i in range(5):
+        for extension in ('.prof', '.folded', '.alloc.txt'):
+            chemin = tmp_path / f"profil{i}{extension}"
+            chemin.write_text('')
+            os.utime(chemin, (i, i))
+
+    application.evincer_profils(str(tmp_path), 2)
+    assert sorted(os.listdir(tmp_path)) == sorted(f"profil{i}{e}" for i in (3, 4) for e in ('.prof', '.folded', '.alloc.txt'))
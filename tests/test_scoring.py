@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+def kpis_aleatoires(application, n, graine=0):
+    rng = np.random.default_rng(graine)
+    return pd.DataFrame({
+        'dep': rng.uniform(0, 100, n).round(1),
+        'temps': rng.integers(0, 60, n),
+        'arch': rng.choice(application.OUI_NON, n),
+        'rd': rng.uniform(0, 20, n).round(1),
+        'poc': rng.integers(0, 15, n),
+        'pue': rng.uniform(1, 3, n).round(2),
+        'rec': rng.choice(application.OUI_NON, n),
+        'dette': rng.choice(application.NIVEAUX_DETTE, n),
+        'taux_transfo': rng.uniform(0, 100, n).round(0),
+        'energie_verte': rng.uniform(0, 100, n).round(0),
+    })
+
+
+def test_scores_vectorises_identiques_au_calcul_scalaire(application):
+    df = kpis_aleatoires(application, 3000)
+    vectorises = application.calculer_scores_vectorises(df)
+
+    for index, inputs in zip(df.index, df.to_dict('records')):
+        score_a, score_i, score_d, global_score = application.calculer_scores(inputs)
+        diagnostic = application.generer_diagnostic(global_score, score_a, score_i, score_d, inputs)
+        ligne = vectorises.loc[index]
+        assert (ligne['score_adaptabilite'], ligne['score_innovation'], ligne['score_durabilite']) == (score_a, score_i, score_d)
+        assert ligne['score_global'] == global_score
+        assert ligne['diagnostic_type'] == diagnostic['type']
+        assert ligne['recommandations'] == str(diagnostic['recos'])
+
+
+def test_scores_vectorises_sur_dataframe_vide(application):
+    df = kpis_aleatoires(application, 0)
+    assert application.calculer_scores_vectorises(df).empty
+
+
+def test_rescorer_met_a_jour_la_version_de_tous_les_audits_verifies(application):
+    with application.app.app_context():
+        inputs = kpis_aleatoires(application, 1, graine=1).to_dict('records')[0]
+        score_a, score_i, score_d, global_score = application.calculer_scores(inputs)
+        diagnostic = application.generer_diagnostic(global_score, score_a, score_i, score_d, inputs)
+        audit = application.Audit(
+            score_adaptabilite=score_a, score_innovation=score_i, score_durabilite=score_d, score_global=global_score,
+            diagnostic_type=diagnostic['type'], recommandations=str(diagnostic['recos']),
+            regles_version=application.REGLES_VERSION - 1,
+            **{colonne: inputs[cle] for cle, colonne in application.COLONNES_KPI.items()})
+        application.db.session.add(audit)
+        application.db.session.commit()
+        id_audit = audit.id
+
+    resultat = application.app.test_cli_runner().invoke(args=['rescorer'])
+    assert resultat.exit_code == 0, resultat.output
+
+    with application.app.app_context():
+        audit = application.db.session.get(application.Audit, id_audit)
+        assert audit.score_global == global_score
+        assert audit.regles_version == application.REGLES_VERSION
@@ -0,0 +1,28 @@
+AUDIT_FRAP = {'dep': 40, 'temps': 30, 'arch': 'non', 'rd': 1, 'poc': 0, 'pue': 2.0, 'rec': 'non',
+              'dette': 'critique', 'taux_transfo': 0, 'energie_verte': 0}
+
+
+def test_poids_invalide_rejete(client):
+    reponse = client.post('/api/simulate', json={**AUDIT_FRAP, 'poids': [1]})
+    assert reponse.status_code == 400
+
+
+def test_pas_reduit_pour_tenir_dans_la_grille(application, client):
+    reponse = client.post('/api/simulate', json={**AUDIT_FRAP, 'pas': 50})
+    assert reponse.status_code == 200
+    resultat = reponse.get_json()
+    assert 2 <= resultat['pas'] < 50
+    assert resultat['points_evalues'] <= application.MAX_POINTS_SIMULATION
+    assert resultat['chemins']['frabop']
+
+
+def test_kpis_hors_schema_rejetes(client):
+    for kpi in ({'pue': 'nan'}, {'pue': 'inf'}, {'temps': 1e300}, {'dette': 'xyz'}, {'dep': None}):
+        reponse = client.post('/api/simulate', json={**AUDIT_FRAP, **kpi})
+        assert reponse.status_code == 400, kpi
+        assert next(iter(kpi)) in reponse.get_json()['erreur']
+
+
+def test_corps_non_objet_rejete(client):
+    assert client.post('/api/simulate', json=[1, 2]).status_code == 400
+    assert client.post('/api/simulate', json={**AUDIT_FRAP, 'pas': 'x'}).status_code == 400